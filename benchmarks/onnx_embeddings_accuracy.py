@@ -0,0 +1,84 @@
+"""Compare embeddings of the quantized ONNX export with the PyTorch model: cosine
+similarity of embeddings of the same texts and agreement of nearest neighbours"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from crag.embeddings.onnx_embeddings import OnnxEmbeddings
+
+
+def read_texts(path: str) -> list[str]:
+    with open(path) as f:
+        return [json.loads(line)["page_content"] for line in f if line.strip()]
+
+
+def timed_embed(embeddings, texts: list[str]) -> tuple[np.ndarray, float]:
+    start_time = time.perf_counter()
+    result = np.array(embeddings.embed_documents(texts), dtype=np.float32)
+    return result, time.perf_counter() - start_time
+
+
+def normalized(x: np.ndarray) -> np.ndarray:
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--model", default=".models/ukr-paraphrase-multilingual-mpnet-base"
+    )
+    parser.add_argument(
+        "--onnx-model",
+        default=".models/ukr-paraphrase-multilingual-mpnet-base-onnx-int8",
+    )
+    parser.add_argument(
+        "--texts",
+        default="benchmarks/data/facts.jsonl",
+        help="JSONL file with page_content fields",
+    )
+    parser.add_argument("--intra-op-threads", type=int, default=None)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    texts = read_texts(args.texts)
+    torch_embeddings, torch_time = timed_embed(
+        HuggingFaceEmbeddings(model_name=args.model), texts
+    )
+    onnx_embeddings, onnx_time = timed_embed(
+        OnnxEmbeddings(args.onnx_model, intra_op_threads=args.intra_op_threads), texts
+    )
+
+    torch_embeddings = normalized(torch_embeddings)
+    onnx_embeddings = normalized(onnx_embeddings)
+    cosine = (torch_embeddings * onnx_embeddings).sum(axis=1)
+
+    # nearest neighbours of every text among the other ones
+    k = min(args.k, len(texts) - 1)
+    neighbours = []
+    for x in (torch_embeddings, onnx_embeddings):
+        similarity = x @ x.T
+        np.fill_diagonal(similarity, -np.inf)
+        neighbours.append(np.argsort(-similarity, axis=1)[:, :k])
+    overlap = [
+        len(set(a) & set(b)) / k for a, b in zip(neighbours[0], neighbours[1])
+    ]
+    top1_agreement = (neighbours[0][:, 0] == neighbours[1][:, 0]).mean()
+
+    report = {
+        "num_texts": len(texts),
+        "cosine_mean": round(float(cosine.mean()), 5),
+        "cosine_min": round(float(cosine.min()), 5),
+        f"top{k}_overlap": round(float(np.mean(overlap)), 4),
+        "top1_agreement": round(float(top1_agreement), 4),
+        "torch_seconds": round(torch_time, 3),
+        "onnx_seconds": round(onnx_time, 3),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List
+from uuid import UUID
+
+import hydra
+import numpy as np
+from hydra import compose
+from hydra.core.hydra_config import HydraConfig
+from hydra.utils import instantiate
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.outputs import LLMResult
+from omegaconf import DictConfig
+
+
+class PipelineMetricsHandler(BaseCallbackHandler):
+    """Collects wall time of graph nodes and counts LLM calls and tokens"""
+
+    run_inline = True
+
+    def __init__(self, token_counter: Callable[[str], int]) -> None:
+        self._lock = threading.Lock()
+        self._token_counter = token_counter
+        self._node_starts: Dict[UUID, tuple[str, float]] = {}
+        self.node_times: Dict[str, List[float]] = defaultdict(list)
+        self.llm_calls = 0
+        self.llm_prompt_chars = 0
+        self.llm_prompt_tokens = 0
+        self.llm_completion_tokens = 0
+
+    def on_chain_start(
+        self,
+        serialized: Dict[str, Any],
+        inputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        metadata: Dict[str, Any] | None = None,
+        **kwargs: Any,
+    ) -> None:
+        node = (metadata or {}).get("langgraph_node")
+        # count only node runs, not nested chains and service nodes
+        name = kwargs.get("name")
+        if node is not None and name == node and not node.startswith("__"):
+            with self._lock:
+                self._node_starts[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            start = self._node_starts.pop(run_id, None)
+            if start is not None:
+                node, start_time = start
+                self.node_times[node].append(time.perf_counter() - start_time)
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
+    ) -> None:
+        # called once per prompt even for batched calls
+        prompt_tokens = sum(self._token_counter(prompt) for prompt in prompts)
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_prompt_chars += sum(len(prompt) for prompt in prompts)
+            self.llm_prompt_tokens += prompt_tokens
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        completion_tokens = sum(
+            self._token_counter(gen.text)
+            for gens in response.generations
+            for gen in gens
+        )
+        with self._lock:
+            self.llm_completion_tokens += completion_tokens
+
+
+def latency_stats(times: List[float]) -> Dict[str, float]:
+    if len(times) == 0:
+        return {"count": 0}
+
+    values = np.asarray(times)
+    return {
+        "count": len(times),
+        "mean": round(float(values.mean()), 4),
+        "p50": round(float(np.percentile(values, 50)), 4),
+        "p95": round(float(np.percentile(values, 95)), 4),
+        "max": round(float(values.max()), 4),
+    }
+
+
+def load_corpus(path: str) -> List[Document]:
+    with open(path, encoding="utf-8") as file:
+        return [Document(**json.loads(line)) for line in file if line.strip()]
+
+
+async def run_level(
+    graph, llm: BaseLanguageModel, config: DictConfig, concurrency: int
+) -> Dict[str, Any]:
+    handler = PipelineMetricsHandler(llm.get_num_tokens)
+    semaphore = asyncio.Semaphore(concurrency)
+    questions = config["questions"]
+    request_times = []
+    rewrites = 0
+
+    async def run_request(idx: int) -> None:
+        nonlocal rewrites
+        async with semaphore:
+            start = time.perf_counter()
+            response = await graph.ainvoke(
+                {
+                    "question": questions[idx % len(questions)],
+                    "do_generate": not config["only_docs"],
+                    "failed": False,
+                    "remaining_rewrites": 1,
+                },
+                config={
+                    "callbacks": [handler],
+                    "configurable": {"chat_id": idx % config["num_chats"]},
+                },
+            )
+            request_times.append(time.perf_counter() - start)
+            rewrites += 1 - response.get("remaining_rewrites", 1)
+
+    num_requests = config["num_requests"]
+    start = time.perf_counter()
+    await asyncio.gather(*[run_request(i) for i in range(num_requests)])
+    wall_time = time.perf_counter() - start
+
+    return {
+        "wall_time": round(wall_time, 4),
+        "throughput_rps": round(num_requests / wall_time, 4),
+        "request_latency": latency_stats(request_times),
+        "node_latency": {
+            node: latency_stats(times)
+            for node, times in sorted(handler.node_times.items())
+        },
+        "llm_calls": handler.llm_calls,
+        "llm_calls_per_request": round(handler.llm_calls / num_requests, 4),
+        "llm_prompt_chars": handler.llm_prompt_chars,
+        "llm_prompt_tokens": handler.llm_prompt_tokens,
+        "llm_completion_tokens": handler.llm_completion_tokens,
+        "rewrites": rewrites,
+    }
+
+
+async def benchmark_pipeline(config: DictConfig) -> Dict[str, Any]:
+    pipeline = instantiate(config["pipeline"])
+    await pipeline.pipe_retriever.aadd_documents(load_corpus(config["corpus_path"]))
+    graph = pipeline.graph
+
+    return {
+        str(concurrency): await run_level(graph, pipeline.llm, config, concurrency)
+        for concurrency in config["concurrency"]
+    }
+
+
+@hydra.main(version_base="1.3", config_path="../configs", config_name="benchmark")
+def main(config: DictConfig) -> None:
+    overrides = [
+        override
+        for override in HydraConfig.get().overrides.task
+        if not override.startswith("pipeline=")
+    ]
+
+    results = {}
+    for pipeline_name in config["pipelines"]:
+        pipeline_config = compose(
+            config_name="benchmark", overrides=overrides + [f"pipeline={pipeline_name}"]
+        )
+        results[pipeline_name] = asyncio.run(benchmark_pipeline(pipeline_config))
+
+    report = {
+        "llm": {
+            "prefill_latency": config["llm"].get("prefill_latency"),
+            "token_latency": config["llm"].get("token_latency"),
+        },
+        "num_requests": config["num_requests"],
+        "pipelines": results,
+    }
+    with open(config["output"], "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, Mapping, Tuple
+
+SCOPES = ("user", "chat")
+
+
+class AdmissionRejectedError(RuntimeError):
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"Request rejected, retry after {retry_after:.1f} s")
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class BucketLimit:
+    # number of requests per minute
+    rate: float
+    # number of requests which can be made at once
+    burst: int
+
+
+@dataclass
+class _TokenBucket:
+    tokens: float
+    updated_at: float
+
+    def refill(self, limit: BucketLimit, now: float) -> None:
+        elapsed = now - self.updated_at
+        self.tokens = min(limit.burst, self.tokens + elapsed * limit.rate / 60)
+        self.updated_at = now
+
+    def wait_time(self, limit: BucketLimit) -> float:
+        if self.tokens >= 1:
+            return 0.0
+        if limit.rate <= 0:
+            return float("inf")
+        return (1 - self.tokens) * 60 / limit.rate
+
+
+class AdmissionController:
+    """Token bucket rate limits per user and per chat for every quota (e.g.
+    `answer` and `docs`) and a global limit of LLM jobs (answers which aren't
+    cached or coalesced) run at the same time. Limits are read on every
+    request, so they can be changed at runtime.
+    """
+
+    def __init__(
+        self,
+        quotas: Mapping[str, Mapping[str, Mapping[str, float]]],
+        max_in_flight: int,
+        max_buckets: int = 100_000,
+    ) -> None:
+        self.limits: Dict[Tuple[str, str], BucketLimit] = {
+            (quota, scope): BucketLimit(limit["rate"], int(limit["burst"]))
+            for quota, scope_limits in quotas.items()
+            for scope, limit in scope_limits.items()
+        }
+        self.max_in_flight = max_in_flight
+        self._max_buckets = max_buckets
+        self._buckets: Dict[Tuple[str, str, int], _TokenBucket] = {}
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def quotas(self) -> Tuple[str, ...]:
+        return tuple(dict.fromkeys(quota for quota, _ in self.limits))
+
+    def set_limit(self, quota: str, scope: str, rate: float, burst: int) -> None:
+        if quota not in self.quotas:
+            raise KeyError(f"Unknown quota {quota}")
+        if scope not in SCOPES:
+            raise KeyError(f"Unknown scope {scope}")
+        if rate < 0 or burst < 1:
+            raise ValueError("Rate must be non negative and burst positive")
+        self.limits[(quota, scope)] = BucketLimit(rate, burst)
+
+    def set_max_in_flight(self, max_in_flight: int) -> None:
+        if max_in_flight < 1:
+            raise ValueError("Limit of in-flight requests must be positive")
+        self.max_in_flight = max_in_flight
+
+    def _bucket(self, key: Tuple[str, str, int], limit: BucketLimit, now: float):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self._max_buckets:
+                self._prune(now)
+            bucket = self._buckets[key] = _TokenBucket(limit.burst, now)
+        else:
+            bucket.refill(limit, now)
+        return bucket
+
+    def _prune(self, now: float) -> None:
+        # a full bucket is the same as a missing one
+        for key, bucket in list(self._buckets.items()):
+            limit = self.limits.get(key[:2])
+            if limit is not None:
+                bucket.refill(limit, now)
+            if limit is None or bucket.tokens >= limit.burst:
+                del self._buckets[key]
+
+    @contextmanager
+    def admit(self, quota: str, user_id: int, chat_id: int) -> Iterator[None]:
+        """Take a token from the user and the chat buckets of the quota.
+        Raises AdmissionRejectedError if any of them is exhausted."""
+        now = time.monotonic()
+        buckets = []
+        for scope, id in zip(SCOPES, (user_id, chat_id)):
+            limit = self.limits.get((quota, scope))
+            if limit is not None:
+                buckets.append(self._bucket((quota, scope, id), limit, now))
+                retry_after = buckets[-1].wait_time(limit)
+                if retry_after > 0:
+                    raise AdmissionRejectedError(retry_after)
+        # tokens are taken only if the request is admitted by all buckets
+        for bucket in buckets:
+            bucket.tokens -= 1
+        yield
+
+    @contextmanager
+    def in_flight_slot(self) -> Iterator[None]:
+        """Take a slot of in-flight LLM jobs for the time of the block.
+        Raises AdmissionRejectedError if all of them are taken."""
+        if self._in_flight >= self.max_in_flight:
+            raise AdmissionRejectedError(0.0)
+
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
@@ -1,7 +1,8 @@
+import asyncio
 import logging
 import os
 from functools import partial
-from typing import Callable, List
+from typing import Awaitable, Callable, Dict, List
 
 import hydra
 from hydra.utils import call, instantiate
@@ -11,6 +12,7 @@ from omegaconf import DictConfig
 from sqlalchemy.orm import sessionmaker
 from telegram import Update
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
@@ -18,6 +20,7 @@ from telegram.ext import (
     filters,
 )
 
+from bot.admission import AdmissionController
 from bot.db import get_db_sessionmaker
 from bot.handlers.management import (
     add_admin,
@@ -26,32 +29,63 @@ from bot.handlers.management import (
     add_facts_from_link,
     ban_user,
     delete_fact,
+    set_limit,
+    show_limits,
     unban_user,
 )
 from bot.handlers.rag import (
     answer,
     answer_to_replied,
+    infer_graph,
     retieve_docs,
     retieve_docs_to_replied,
 )
 from bot.handlers.service import error, help, ignore, reaction, start, unknown
+from bot.permissions import PermissionsCache
+from bot.startup import Startup
+from bot.update_processor import ChatOrderedUpdateProcessor
+from crag.cache import (
+    CacheInvalidatingRetriever,
+    RequestCoalescer,
+    SemanticAnswerCache,
+)
+from crag.knowledge.loaders.http_client import aclose_session
 from crag.knowledge.transformations.sequence import TransformationSequence
+from crag.llm import LLMScheduler
 from crag.retrievers.base import PipelineRetrieverBase
+from crag.tracing import start_metrics_server
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
+logger = logging.getLogger(__name__)
 
 
-def prepare_rag_based_handlers(graph: Runnable, db_session: sessionmaker):
-    answer_with_graph = partial(answer, graph=graph, db_session=db_session)
-    answer_to_replied_with_graph = partial(
-        answer_to_replied, graph=graph, db_session=db_session
+def prepare_rag_based_handlers(
+    graph: Runnable,
+    permissions: PermissionsCache,
+    answer_cache: SemanticAnswerCache | None = None,
+    llm_scheduler: LLMScheduler | None = None,
+    stream_edit_interval: float | None = None,
+    coalescer: RequestCoalescer | None = None,
+    admission: AdmissionController | None = None,
+):
+    kwargs = {
+        "graph": graph,
+        "permissions": permissions,
+        "answer_cache": answer_cache,
+        "llm_scheduler": llm_scheduler,
+        "coalescer": coalescer,
+        "admission": admission,
+    }
+    answer_with_graph = partial(
+        answer, stream_edit_interval=stream_edit_interval, **kwargs
     )
-    retieve_docs_with_graph = partial(retieve_docs, graph=graph, db_session=db_session)
-    retieve_docs_to_replied_with_graph = partial(
-        retieve_docs_to_replied, graph=graph, db_session=db_session
+    answer_to_replied_with_graph = partial(
+        answer_to_replied, stream_edit_interval=stream_edit_interval, **kwargs
     )
+    retieve_docs_with_graph = partial(retieve_docs, **kwargs)
+    retieve_docs_to_replied_with_graph = partial(retieve_docs_to_replied, **kwargs)
 
     return {
         "answer": answer_with_graph,
@@ -64,90 +98,209 @@ def prepare_rag_based_handlers(graph: Runnable, db_session: sessionmaker):
 def prepare_management_handlers(
     pipe_retriever: PipelineRetrieverBase,
     db_session: sessionmaker,
-    url_loader: Callable[[List[str]], List[Document]],
+    permissions: PermissionsCache,
+    url_loader: Callable[[List[str]], List[Document] | Awaitable[List[Document]]],
     doc_transformator: TransformationSequence,
+    admission: AdmissionController | None = None,
 ):
     handlers = {}
     handlers["add_fact"] = partial(
         add_fact,
         pipe_retriever=pipe_retriever,
-        db_session=db_session,
+        permissions=permissions,
         doc_transformator=doc_transformator,
     )
     handlers["add_fact_from_replied"] = partial(
         add_fact_from_replied,
         pipe_retriever=pipe_retriever,
-        db_session=db_session,
+        permissions=permissions,
         doc_transformator=doc_transformator,
     )
     handlers["add_facts_from_link"] = partial(
         add_facts_from_link,
         pipe_retriever=pipe_retriever,
-        db_session=db_session,
+        permissions=permissions,
         url_loader=url_loader,
         doc_transformator=doc_transformator,
     )
     handlers["delete_fact"] = partial(
-        delete_fact, pipe_retriever=pipe_retriever, db_session=db_session
+        delete_fact, pipe_retriever=pipe_retriever, permissions=permissions
+    )
+    handlers["ban_user"] = partial(
+        ban_user, db_session=db_session, permissions=permissions
+    )
+    handlers["unban_user"] = partial(
+        unban_user, db_session=db_session, permissions=permissions
+    )
+    handlers["add_admin"] = partial(
+        add_admin, db_session=db_session, permissions=permissions
+    )
+    handlers["show_limits"] = partial(
+        show_limits, admission=admission, permissions=permissions
+    )
+    handlers["set_limit"] = partial(
+        set_limit, admission=admission, permissions=permissions
     )
-    handlers["ban_user"] = partial(ban_user, db_session=db_session)
-    handlers["unban_user"] = partial(unban_user, db_session=db_session)
-    handlers["add_admin"] = partial(add_admin, db_session=db_session)
 
     return handlers
 
 
-def prepare_handlers(config: DictConfig):
-    db_session = get_db_sessionmaker(config["bot_db_connection"])
-    pipeline = instantiate(config["pipeline"])
+async def aprepare_handlers(
+    config: DictConfig,
+    db_session: sessionmaker,
+    permissions: PermissionsCache,
+    startup: Startup,
+) -> Dict[str, Callable]:
     url_loader = call(config["knowledge"]["loader"])
     doc_transformator = call(config["knowledge"]["transform"])
 
-    rag_handlers = prepare_rag_based_handlers(pipeline.graph, db_session)
+    # heavy components (models, database and search clients) are built concurrently
+    pipeline_config = config["pipeline"]
+    names = [
+        name
+        for name in ("llm", "retriever", "relevance_filter")
+        if pipeline_config.get(name) is not None
+    ]
+    components = await asyncio.gather(
+        *(
+            startup.timed(name, asyncio.to_thread(instantiate, pipeline_config[name]))
+            for name in names
+        )
+    )
+    pipeline = await startup.timed(
+        "pipeline",
+        asyncio.to_thread(instantiate, pipeline_config, **dict(zip(names, components))),
+    )
+
+    pipe_retriever = pipeline.pipe_retriever
+    answer_cache = None
+    if config.get("answer_cache") is not None:
+        # reuse the embeddings model already loaded by the retriever
+        embeddings = pipe_retriever.embeddings
+        if embeddings is None:
+            raise ValueError("Answer cache requires a retriever with embeddings")
+        answer_cache = instantiate(config["answer_cache"])(embeddings=embeddings)
+        # invalidate the cache on every change of the knowledge base
+        pipe_retriever = CacheInvalidatingRetriever(pipe_retriever, answer_cache)
+
+    graph = pipeline.graph
+    # fill caches which would be otherwise filled by the first request
+    if hasattr(pipeline.llm, "warm_up"):
+        # e.g. KV states of prompt prefixes (see crag.llm.PrefixCachedLlamaCpp)
+        await startup.timed("llm_warm_up", asyncio.to_thread(pipeline.llm.warm_up))
+    warm_up = config.get("warm_up")
+    if warm_up is not None:
+        try:
+            await startup.timed(
+                "warm_up_query",
+                infer_graph(
+                    graph, warm_up["question"], only_docs=not warm_up["generate"]
+                ),
+            )
+        except Exception:
+            # the bot still can answer, only slower
+            logger.exception("Warm-up query failed")
+
+    coalescer = RequestCoalescer() if config.get("coalesce_requests") else None
+    admission = None
+    if config.get("admission") is not None:
+        admission = instantiate(config["admission"])
+    rag_handlers = prepare_rag_based_handlers(
+        graph,
+        permissions,
+        answer_cache,
+        pipeline.llm_scheduler,
+        config.get("stream_edit_interval"),
+        coalescer,
+        admission,
+    )
     manag_handlers = prepare_management_handlers(
-        pipeline.pipe_retriever, db_session, url_loader, doc_transformator
+        pipe_retriever,
+        db_session,
+        permissions,
+        url_loader,
+        doc_transformator,
+        admission,
     )
 
-    return rag_handlers, manag_handlers
+    return rag_handlers | manag_handlers
 
 
 @hydra.main(version_base="1.3", config_path="../configs", config_name="default")
 def main(config: DictConfig) -> None:
-    rag_handlers, manag_handlers = prepare_handlers(config)
+    db_conn_string = config["bot_db_connection"]
+    # one engine (and connection pool) for the handlers and the permissions cache
+    db_session = get_db_sessionmaker(db_conn_string)
+    permissions = PermissionsCache(db_session, config.get("permissions_notify_channel"))
+    # handlers are built after polling starts, until then the bot answers that
+    # it is starting up
+    startup = Startup()
+
+    metrics_runner = None
+
+    async def post_init(application: Application) -> None:
+        nonlocal metrics_runner
+        await permissions.aload()
+        application.create_task(permissions.alisten(db_conn_string))
+        if config.get("metrics") is not None:
+            metrics_runner = await start_metrics_server(**config["metrics"])
+        application.create_task(
+            startup.run(partial(aprepare_handlers, config, db_session, permissions))
+        )
 
+    async def post_shutdown(application: Application) -> None:
+        await aclose_session()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+    updates_config = config["updates"]
     tgbot_token = os.getenv("TGBOT_TOKEN")
-    application = ApplicationBuilder().token(tgbot_token).build()
+    application = (
+        ApplicationBuilder()
+        .token(tgbot_token)
+        .concurrent_updates(
+            ChatOrderedUpdateProcessor(
+                updates_config["max_concurrent_updates"],
+                updates_config["max_pending_updates"],
+            )
+        )
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     start_handler = CommandHandler("start", start)
     help_handler = CommandHandler("help", help)
     reaction_handler = MessageReactionHandler(reaction)
     edited_message_handler = MessageHandler(filters.UpdateType.EDITED_MESSAGE, ignore)
 
-    answer_handler = CommandHandler("ans", rag_handlers["answer"])
+    answer_handler = CommandHandler("ans", startup.gate("answer"))
     answer_to_replied_handler = CommandHandler(
-        "ans_rep", rag_handlers["answer_to_replied"], filters=filters.REPLY
+        "ans_rep", startup.gate("answer_to_replied"), filters=filters.REPLY
     )
-    retieve_docs_handler = CommandHandler("docs", rag_handlers["retieve"])
+    retieve_docs_handler = CommandHandler("docs", startup.gate("retieve"))
     retieve_docs_to_replied_handler = CommandHandler(
-        "docs_rep", rag_handlers["retieve_to_replied"], filters=filters.REPLY
+        "docs_rep", startup.gate("retieve_to_replied"), filters=filters.REPLY
     )
 
     private_message_handler = MessageHandler(
         filters.TEXT & (~filters.COMMAND) & filters.ChatType.PRIVATE,
-        rag_handlers["answer"],
+        startup.gate("answer"),
     )
 
-    add_fact_handler = CommandHandler("add", manag_handlers["add_fact"])
-    delete_fact_handler = CommandHandler("del", manag_handlers["delete_fact"])
+    add_fact_handler = CommandHandler("add", startup.gate("add_fact"))
+    delete_fact_handler = CommandHandler("del", startup.gate("delete_fact"))
     add_fact_from_replied_handler = CommandHandler(
-        "add_rep", manag_handlers["add_fact_from_replied"]
+        "add_rep", startup.gate("add_fact_from_replied")
     )
     add_facts_from_link_handler = CommandHandler(
-        "add_link", manag_handlers["add_facts_from_link"]
+        "add_link", startup.gate("add_facts_from_link")
     )
-    ban_handler = CommandHandler("ban", manag_handlers["ban_user"])
-    unban_handler = CommandHandler("unban", manag_handlers["unban_user"])
-    add_admin_handler = CommandHandler("add_admin", manag_handlers["add_admin"])
+    ban_handler = CommandHandler("ban", startup.gate("ban_user"))
+    unban_handler = CommandHandler("unban", startup.gate("unban_user"))
+    add_admin_handler = CommandHandler("add_admin", startup.gate("add_admin"))
+    show_limits_handler = CommandHandler("limits", startup.gate("show_limits"))
+    set_limit_handler = CommandHandler("set_limit", startup.gate("set_limit"))
 
     unknown_handler = MessageHandler(filters.COMMAND, unknown)
 
@@ -167,11 +320,20 @@ def main(config: DictConfig) -> None:
     application.add_handler(ban_handler)
     application.add_handler(unban_handler)
     application.add_handler(add_admin_handler)
+    application.add_handler(show_limits_handler)
+    application.add_handler(set_limit_handler)
     application.add_handler(unknown_handler)
 
     application.add_error_handler(error)
 
-    application.run_polling(allowed_updates=Update.MESSAGE)
+    if updates_config["mode"] == "webhook":
+        application.run_webhook(
+            **updates_config["webhook"], allowed_updates=Update.MESSAGE
+        )
+    elif updates_config["mode"] == "polling":
+        application.run_polling(allowed_updates=Update.MESSAGE)
+    else:
+        raise ValueError(f"Unknown updates mode: {updates_config['mode']}")
 
 
 if __name__ == "__main__":
@@ -1,7 +1,6 @@
-from sqlalchemy.future import select
-from telegram.constants import ChatType
+import math
 
-from bot.db import Admin, BannedUserOrChat
+from bot.admission import AdmissionRejectedError
 
 
 def with_db_session(session_param_name="db_session"):
@@ -18,16 +17,16 @@ def with_db_session(session_param_name="db_session"):
 
 
 def admin_only(
-    session_param_name="db_session",
+    permissions_param_name="permissions",
     should_can_add_info=True,
     should_can_add_admins=True,
 ):
     def decorator(handler):
         async def wrapper(*args, **kwargs):
             update, context = args
-            session = kwargs[session_param_name]
+            permissions = kwargs[permissions_param_name]
 
-            admin = await session.get(Admin, update.effective_user.id)
+            admin = permissions.get_admin(update.effective_user.id)
             if (
                 admin is None
                 or (should_can_add_info and not admin.can_add_info)
@@ -47,30 +46,59 @@ def admin_only(
     return decorator
 
 
-def filter_banned(session_param_name="db_session"):
+def filter_banned(permissions_param_name="permissions"):
     def decorator(handler):
         async def wrapper(*args, **kwargs):
             update, _ = args
-            session = kwargs[session_param_name]
+            permissions = kwargs[permissions_param_name]
 
-            banned_user = await session.get(BannedUserOrChat, update.effective_user.id)
-            if banned_user is not None:
+            if permissions.is_banned(
+                update.effective_user.id,
+                update.effective_chat.id,
+                update.effective_chat.type,
+            ):
                 return
 
-            # check whether chat is banned iff chat is a group
-            chat_type = update.effective_chat.type
-            if chat_type == ChatType.GROUP or chat_type == ChatType.SUPERGROUP:
-                banned_chat_query = (
-                    select(BannedUserOrChat)
-                    .where(BannedUserOrChat.tg_id == update.effective_chat.id)
-                    .where(BannedUserOrChat.is_user == False)  # noqa
-                )
-                banned_chat = await session.scalar(banned_chat_query)
-                if banned_chat is not None:
-                    return
-
             await handler(*args, **kwargs)
 
         return wrapper
 
     return decorator
+
+
+def admission_control(
+    quota: str,
+    admission_param_name="admission",
+    permissions_param_name="permissions",
+):
+    def decorator(handler):
+        async def wrapper(*args, **kwargs):
+            update, context = args
+            admission = kwargs.get(admission_param_name)
+            permissions = kwargs[permissions_param_name]
+
+            # admins are not limited
+            user_id = update.effective_user.id
+            if admission is None or permissions.get_admin(user_id) is not None:
+                await handler(*args, **kwargs)
+                return
+
+            try:
+                with admission.admit(quota, user_id, update.effective_chat.id):
+                    await handler(*args, **kwargs)
+            except AdmissionRejectedError as e:
+                text = "Забагато запитів. Спробуйте, будь ласка, пізніше."
+                if e.retry_after >= 1:
+                    text = (
+                        "Забагато запитів. Спробуйте, будь ласка, "
+                        f"через {math.ceil(e.retry_after)} с."
+                    )
+                await context.bot.send_message(
+                    chat_id=update.effective_chat.id,
+                    reply_to_message_id=update.effective_message.id,
+                    text=text,
+                )
+
+        return wrapper
+
+    return decorator
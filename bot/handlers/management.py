@@ -1,4 +1,6 @@
-from typing import Callable, List
+import asyncio
+import inspect
+from typing import Awaitable, Callable, List
 
 from langchain_core.documents import Document
 from sqlalchemy import delete
@@ -6,14 +8,15 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from telegram import Update
 from telegram.ext import ContextTypes
 
+from bot.admission import AdmissionController
 from bot.db import Admin, BannedUserOrChat
 from bot.decorators import admin_only, with_db_session
+from bot.permissions import PermissionsCache
 from bot.utils import remove_bot_command
 from crag.knowledge.transformations.sequence import TransformationSequence
 from crag.retrievers.base import PipelineRetrieverBase
 
 
-@with_db_session()
 @admin_only(should_can_add_admins=False, should_can_add_info=True)
 async def add_fact(
     update: Update,
@@ -58,7 +61,6 @@ async def add_fact(
     )
 
 
-@with_db_session()
 @admin_only(should_can_add_admins=False, should_can_add_info=True)
 async def add_fact_from_replied(
     update: Update,
@@ -107,7 +109,6 @@ async def add_fact_from_replied(
     )
 
 
-@with_db_session()
 @admin_only(should_can_add_info=True, should_can_add_admins=False)
 async def delete_fact(
     update: Update,
@@ -146,13 +147,12 @@ async def delete_fact(
         )
 
 
-@with_db_session()
 @admin_only(should_can_add_admins=False, should_can_add_info=True)
 async def add_facts_from_link(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
     pipe_retriever: PipelineRetrieverBase,
-    url_loader: Callable[[List[str]], List[Document]],
+    url_loader: Callable[[List[str]], List[Document] | Awaitable[List[Document]]],
     doc_transformator: TransformationSequence,
     **kwargs,
 ):
@@ -165,14 +165,30 @@ async def add_facts_from_link(
         return
 
     url = context.args[0]
-    docs = url_loader([url])
-    docs = doc_transformator.apply(docs)
-    ids = await pipe_retriever.aadd_documents(docs)
+    # don't block the event loop during loading and splitting
+    if inspect.iscoroutinefunction(url_loader):
+        docs = await url_loader([url])
+    else:
+        docs = await asyncio.to_thread(url_loader, [url])
+    docs = await asyncio.to_thread(doc_transformator.apply, docs)
+
+    if pipe_retriever.supports_incremental_update:
+        # re-sync the page, i.e. store only changed chunks
+        result = await pipe_retriever.aupdate_documents(docs)
+        text = (
+            "Інформацію з посилання синхронізовано з базою знань. "
+            f"Додано фрагментів: {result['num_added']}, "
+            f"без змін: {result['num_skipped']}, "
+            f"видалено: {result['num_deleted']}."
+        )
+    else:
+        ids = await pipe_retriever.aadd_documents(docs)
+        text = f"Інформацію успішно додано до бази знань з id: {ids}"
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         reply_to_message_id=update.effective_message.id,
-        text=f"Інформацію успішно додано до бази знань з id: {ids}",
+        text=text,
     )
 
 
@@ -203,7 +219,10 @@ async def get_user_id_from_message(
 @with_db_session()
 @admin_only(should_can_add_admins=False, should_can_add_info=False)
 async def ban_user(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, db_session: AsyncSession
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    db_session: AsyncSession,
+    permissions: PermissionsCache,
 ):
     banned_user_id = await get_user_id_from_message(update, context)
     if banned_user_id is None:
@@ -211,8 +230,7 @@ async def ban_user(
 
     # don't ban admins
     admin_id = update.effective_user.id
-    banned_admin = await db_session.get(Admin, banned_user_id)
-    if banned_admin is not None:
+    if permissions.get_admin(banned_user_id) is not None:
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
             reply_to_message_id=update.effective_message.id,
@@ -225,7 +243,9 @@ async def ban_user(
         tg_id=banned_user_id, is_user=True, banned_by_id=admin_id
     )
     db_session.add(banned_user)
+    await permissions.anotify(db_session)
     await db_session.commit()
+    permissions.ban(banned_user_id, is_user=True)
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -237,7 +257,10 @@ async def ban_user(
 @with_db_session()
 @admin_only(should_can_add_admins=False, should_can_add_info=False)
 async def unban_user(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, db_session: AsyncSession
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    db_session: AsyncSession,
+    permissions: PermissionsCache,
 ):
     banned_user_id = await get_user_id_from_message(update, context)
     if banned_user_id is None:
@@ -245,7 +268,9 @@ async def unban_user(
 
     stmt = delete(BannedUserOrChat).where(BannedUserOrChat.tg_id == banned_user_id)
     result = await db_session.execute(stmt)
+    await permissions.anotify(db_session)
     await db_session.commit()
+    permissions.unban(banned_user_id)
 
     if result.rowcount > 0:
         await context.bot.send_message(
@@ -258,7 +283,10 @@ async def unban_user(
 @with_db_session()
 @admin_only(should_can_add_admins=True, should_can_add_info=False)
 async def add_admin(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, db_session: AsyncSession
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    db_session: AsyncSession,
+    permissions: PermissionsCache,
 ):
     new_admin_id = await get_user_id_from_message(update, context, 3)
     if new_admin_id is None:
@@ -292,10 +320,82 @@ async def add_admin(
         added_by_id=curr_admin_id,
     )
     db_session.add(new_admin)
+    await permissions.anotify(db_session)
     await db_session.commit()
+    permissions.add_admin(new_admin_id, can_add_info, can_add_admin)
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         reply_to_message_id=update.effective_message.id,
         text="Вказаного користувача було додано до списку адмінів!",
     )
+
+
+def limits_to_str(admission: AdmissionController) -> str:
+    rows = [
+        f"{quota} ({scope}): {limit.rate:g} запитів/хв, запас {limit.burst}"
+        for (quota, scope), limit in admission.limits.items()
+    ]
+    rows.append(
+        "Одночасних запитів до LLM: "
+        f"{admission.in_flight} з {admission.max_in_flight} (in_flight)"
+    )
+    return "\n".join(rows)
+
+
+@admin_only(should_can_add_admins=True, should_can_add_info=False)
+async def show_limits(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    admission: AdmissionController | None,
+    **kwargs,
+):
+    if admission is None:
+        text = "Обмеження кількості запитів вимкнено."
+    else:
+        text = limits_to_str(admission)
+
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        reply_to_message_id=update.effective_message.id,
+        text=text,
+    )
+
+
+@admin_only(should_can_add_admins=True, should_can_add_info=False)
+async def set_limit(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    admission: AdmissionController | None,
+    **kwargs,
+):
+    if admission is None:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            reply_to_message_id=update.effective_message.id,
+            text="Обмеження кількості запитів вимкнено.",
+        )
+        return
+
+    try:
+        if len(context.args) == 2 and context.args[0] == "in_flight":
+            admission.set_max_in_flight(int(context.args[1]))
+        elif len(context.args) == 4:
+            quota, scope, rate, burst = context.args
+            admission.set_limit(quota, scope, float(rate), int(burst))
+        else:
+            raise ValueError("Wrong number of arguments")
+    except (KeyError, ValueError):
+        text = (
+            "Неправильний формат аргументів. Очікувалось: "
+            "<квота> <user|chat> <запитів/хв> <запас> або in_flight <кількість>. "
+            f"Квоти: {', '.join(admission.quotas)}."
+        )
+    else:
+        text = "Обмеження змінено:\n" + limits_to_str(admission)
+
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        reply_to_message_id=update.effective_message.id,
+        text=text,
+    )
@@ -1,25 +1,106 @@
+from contextlib import ExitStack
+from typing import Awaitable, Callable
+
 from langchain_core.runnables import Runnable
 from telegram import Update
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 
-from bot.decorators import filter_banned, with_db_session
+from bot.admission import AdmissionController, AdmissionRejectedError
+from bot.decorators import admission_control, filter_banned
+from bot.permissions import PermissionsCache
+from bot.streaming import ThrottledMessageEditor
 from bot.utils import docs_to_sources_str, make_html_quote, remove_bot_command
+from crag.cache import RequestCoalescer, SemanticAnswerCache, normalize_question
+from crag.llm import LLMQueueFullError, LLMScheduler
 
+SKIPPED_STAGE_NAMES = {
+    "grading": "перевірку релевантності документів",
+    "rewrite": "переформулювання питання",
+    "generation": "генерацію відповіді",
+}
+
+
+async def notify_if_long_wait(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    llm_scheduler: LLMScheduler | None,
+) -> None:
+    if llm_scheduler is None:
+        return
+
+    chat_id = update.effective_chat.id
+    wait_time = llm_scheduler.estimate_wait(chat_id)
+    if wait_time >= llm_scheduler.long_wait_threshold:
+        position = llm_scheduler.queue_position(chat_id) + 1
+        await context.bot.send_message(
+            chat_id=chat_id,
+            reply_to_message_id=update.effective_message.id,
+            text=(
+                f"Зараз багато запитів. Ваша позиція у черзі: {position}, "
+                f"орієнтовний час очікування: {round(wait_time)} с."
+            ),
+        )
+
+
+async def infer_graph(
+    graph: Runnable,
+    question: str,
+    only_docs: bool = False,
+    answer_cache: SemanticAnswerCache | None = None,
+    chat_id: int | None = None,
+    generation_callback: Callable[[str], Awaitable[None]] | None = None,
+    coalescer: RequestCoalescer | None = None,
+    admission: AdmissionController | None = None,
+) -> str:
+    response = None
+    if answer_cache is not None:
+        cache_key = await answer_cache.akey(question, only_docs)
+        response = answer_cache.get(cache_key)
+
+    async def run_graph(callback: Callable[[str], Awaitable[None]] | None) -> dict:
+        # only answers take a slot of LLM jobs, documents don't need the LLM
+        with ExitStack() as stack:
+            if admission is not None and not only_docs:
+                stack.enter_context(admission.in_flight_slot())
+            response = await graph.ainvoke(
+                {
+                    "question": question,
+                    "do_generate": not only_docs,
+                    "failed": False,
+                    "remaining_rewrites": 1,
+                },
+                config={
+                    "configurable": {
+                        "chat_id": chat_id,
+                        "generation_callback": callback,
+                    }
+                },
+            )
+        # don't serve degraded answers after the load goes down
+        if answer_cache is not None and not response.get("skipped_stages"):
+            answer_cache.put(cache_key, response)
+        return response
+
+    if response is None:
+        try:
+            if coalescer is not None:
+                # the same question asked concurrently is answered only once
+                response = await coalescer.run(
+                    (normalize_question(question), only_docs),
+                    run_graph,
+                    generation_callback,
+                )
+            else:
+                response = await run_graph(generation_callback)
+        except (LLMQueueFullError, AdmissionRejectedError):
+            return "Вибачте, зараз забагато запитів. Спробуйте, будь ласка, пізніше."
 
-async def infer_graph(graph: Runnable, question: str, only_docs: bool = False) -> str:
-    response = await graph.ainvoke(
-        {
-            "question": question,
-            "do_generate": not only_docs,
-            "failed": False,
-            "remaining_rewrites": 1,
-        }
-    )
     output = ""
 
     actual_question = response["question"]
-    if not response["failed"] and question != actual_question:
+    rewritten = normalize_question(actual_question) != normalize_question(question)
+    if not response["failed"] and rewritten:
         output += "Змінено питання/запит на:\n"
         output += make_html_quote(actual_question)
 
@@ -33,13 +114,27 @@ async def infer_graph(graph: Runnable, question: str, only_docs: bool = False) -
         sources_preambule = "\n\nДжерела/найбільш релевантні посилання:\n"
         output += sources_preambule + sources_text
 
+    skipped_stages = response.get("skipped_stages")
+    if skipped_stages:
+        stages = ", ".join(SKIPPED_STAGE_NAMES.get(s, s) for s in skipped_stages)
+        output += f"\n\nЧерез велике навантаження пропущено: {stages}."
+
     return output
 
 
-@with_db_session()
 @filter_banned()
+@admission_control("answer")
 async def answer(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, graph: Runnable, **kwargs
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    graph: Runnable,
+    answer_cache: SemanticAnswerCache | None = None,
+    llm_scheduler: LLMScheduler | None = None,
+    stream_edit_interval: float | None = None,
+    coalescer: RequestCoalescer | None = None,
+    admission: AdmissionController | None = None,
+    permissions: PermissionsCache | None = None,
+    **kwargs,
 ):
     question = remove_bot_command(
         update.effective_message.text, "ans", context.bot.name
@@ -53,20 +148,56 @@ async def answer(
         )
         return
 
-    response = await infer_graph(graph, question)
+    await notify_if_long_wait(update, context, llm_scheduler)
 
-    await context.bot.send_message(
+    # admins are not limited
+    if permissions is not None and permissions.get_admin(update.effective_user.id):
+        admission = None
+
+    editor = None
+    if stream_edit_interval is not None:
+        editor = ThrottledMessageEditor(
+            context.bot,
+            update.effective_chat.id,
+            update.effective_message.id,
+            stream_edit_interval,
+        )
+        await editor.start()
+
+    response = await infer_graph(
+        graph,
+        question,
+        answer_cache=answer_cache,
         chat_id=update.effective_chat.id,
-        reply_to_message_id=update.effective_message.id,
-        text=response,
-        parse_mode=ParseMode.HTML,
+        generation_callback=editor.append if editor is not None else None,
+        coalescer=coalescer,
+        admission=admission,
     )
 
+    if editor is not None:
+        await editor.finish(response)
+    else:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            reply_to_message_id=update.effective_message.id,
+            text=response,
+            parse_mode=ParseMode.HTML,
+        )
+
 
-@with_db_session()
 @filter_banned()
+@admission_control("answer")
 async def answer_to_replied(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, graph: Runnable, **kwargs
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    graph: Runnable,
+    answer_cache: SemanticAnswerCache | None = None,
+    llm_scheduler: LLMScheduler | None = None,
+    stream_edit_interval: float | None = None,
+    coalescer: RequestCoalescer | None = None,
+    admission: AdmissionController | None = None,
+    permissions: PermissionsCache | None = None,
+    **kwargs,
 ):
     question = remove_bot_command(
         update.effective_message.reply_to_message.text, "ans_rep", context.bot.name
@@ -80,20 +211,53 @@ async def answer_to_replied(
         )
         return
 
-    response = await infer_graph(graph, question)
+    await notify_if_long_wait(update, context, llm_scheduler)
 
-    await context.bot.send_message(
+    # admins are not limited
+    if permissions is not None and permissions.get_admin(update.effective_user.id):
+        admission = None
+
+    editor = None
+    if stream_edit_interval is not None:
+        editor = ThrottledMessageEditor(
+            context.bot,
+            update.effective_chat.id,
+            update.effective_message.reply_to_message.id,
+            stream_edit_interval,
+        )
+        await editor.start()
+
+    response = await infer_graph(
+        graph,
+        question,
+        answer_cache=answer_cache,
         chat_id=update.effective_chat.id,
-        reply_to_message_id=update.effective_message.reply_to_message.id,
-        text=response,
-        parse_mode=ParseMode.HTML,
+        generation_callback=editor.append if editor is not None else None,
+        coalescer=coalescer,
+        admission=admission,
     )
 
+    if editor is not None:
+        await editor.finish(response)
+    else:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            reply_to_message_id=update.effective_message.reply_to_message.id,
+            text=response,
+            parse_mode=ParseMode.HTML,
+        )
+
 
-@with_db_session()
 @filter_banned()
+@admission_control("docs")
 async def retieve_docs(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, graph: Runnable, **kwargs
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    graph: Runnable,
+    answer_cache: SemanticAnswerCache | None = None,
+    llm_scheduler: LLMScheduler | None = None,
+    coalescer: RequestCoalescer | None = None,
+    **kwargs,
 ):
     question = remove_bot_command(
         update.effective_message.text, "docs", context.bot.name
@@ -107,7 +271,15 @@ async def retieve_docs(
         )
         return
 
-    response = await infer_graph(graph, question, only_docs=True)
+    await notify_if_long_wait(update, context, llm_scheduler)
+    response = await infer_graph(
+        graph,
+        question,
+        only_docs=True,
+        answer_cache=answer_cache,
+        chat_id=update.effective_chat.id,
+        coalescer=coalescer,
+    )
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -117,10 +289,16 @@ async def retieve_docs(
     )
 
 
-@with_db_session()
 @filter_banned()
+@admission_control("docs")
 async def retieve_docs_to_replied(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, graph: Runnable, **kwargs
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    graph: Runnable,
+    answer_cache: SemanticAnswerCache | None = None,
+    llm_scheduler: LLMScheduler | None = None,
+    coalescer: RequestCoalescer | None = None,
+    **kwargs,
 ):
     question = remove_bot_command(
         update.effective_message.reply_to_message.text, "docs_rep", context.bot.name
@@ -134,7 +312,15 @@ async def retieve_docs_to_replied(
         )
         return
 
-    response = await infer_graph(graph, question, only_docs=True)
+    await notify_if_long_wait(update, context, llm_scheduler)
+    response = await infer_graph(
+        graph,
+        question,
+        only_docs=True,
+        answer_cache=answer_cache,
+        chat_id=update.effective_chat.id,
+        coalescer=coalescer,
+    )
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
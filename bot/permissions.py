@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict
+
+import psycopg
+from psycopg import sql
+from sqlalchemy import select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from telegram.constants import ChatType
+
+from bot.db import Admin, BannedUserOrChat
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class AdminPermissions:
+    can_add_info: bool
+    can_add_new_admins: bool
+
+
+class PermissionsCache:
+    """In-process cache of banned users/chats and admin permissions.
+    It is loaded at startup and updated write-through by management handlers.
+    If a notification channel is given, every change is announced via
+    Postgres NOTIFY and all bot processes listening to it reload the cache.
+    """
+
+    def __init__(self, db_session: sessionmaker, notify_channel: str | None = None):
+        self._db_session = db_session
+        self._notify_channel = notify_channel
+        self._banned: Dict[int, bool] = {}  # tg_id -> is_user
+        self._admins: Dict[int, AdminPermissions] = {}
+
+    async def aload(self) -> None:
+        async with self._db_session() as session:
+            banned = {
+                v.tg_id: v.is_user
+                for v in await session.scalars(select(BannedUserOrChat))
+            }
+            admins = {
+                v.tg_id: AdminPermissions(v.can_add_info, v.can_add_new_admins)
+                for v in await session.scalars(select(Admin))
+            }
+        self._banned = banned
+        self._admins = admins
+
+    def is_banned(self, user_id: int, chat_id: int, chat_type: str) -> bool:
+        if user_id in self._banned:
+            return True
+
+        # check whether chat is banned iff chat is a group
+        if chat_type == ChatType.GROUP or chat_type == ChatType.SUPERGROUP:
+            return self._banned.get(chat_id) is False
+
+        return False
+
+    def get_admin(self, tg_id: int) -> AdminPermissions | None:
+        return self._admins.get(tg_id)
+
+    def ban(self, tg_id: int, is_user: bool) -> None:
+        self._banned[tg_id] = is_user
+
+    def unban(self, tg_id: int) -> None:
+        self._banned.pop(tg_id, None)
+
+    def add_admin(self, tg_id: int, can_add_info: bool, can_add_new_admins: bool):
+        self._admins[tg_id] = AdminPermissions(can_add_info, can_add_new_admins)
+
+    async def anotify(self, session: AsyncSession) -> None:
+        """Announce a change to other bot processes. Should be called within
+        the transaction which changes permissions, so the notification is
+        delivered iff the transaction is commited."""
+        if self._notify_channel is not None:
+            await session.execute(
+                text("SELECT pg_notify(:channel, '')"),
+                {"channel": self._notify_channel},
+            )
+
+    async def alisten(self, conn_string: str, retry_delay: float = 5.0) -> None:
+        """Reload the cache on every notification from other bot processes"""
+        if self._notify_channel is None:
+            return
+
+        url = make_url(conn_string).set(drivername="postgresql")
+        conninfo = url.render_as_string(hide_password=False)
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(
+                    conninfo, autocommit=True
+                ) as conn:
+                    channel = sql.Identifier(self._notify_channel)
+                    await conn.execute(sql.SQL("LISTEN {}").format(channel))
+                    # changes could be missed while there was no connection
+                    await self.aload()
+                    async for _ in conn.notifies():
+                        await self.aload()
+            except psycopg.OperationalError as e:
+                logger.warning("Permissions listener connection failed: %s", e)
+                await asyncio.sleep(retry_delay)
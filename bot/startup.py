@@ -0,0 +1,75 @@
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from crag.tracing import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+Handler = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]
+
+_STARTUP_DURATION = REGISTRY.gauge(
+    "crag_startup_duration_seconds", "Time spent on a startup step"
+)
+
+
+class Startup:
+    """Builds the bot handlers in the background, so the bot can be polled while
+    the models are being loaded. Handlers returned by `gate` answer that the bot is
+    starting up until the handlers are built and warmed up."""
+
+    def __init__(self) -> None:
+        self.timings: Dict[str, float] = {}
+        self._handlers: Dict[str, Handler] | None = None
+        self._failed = False
+
+    @property
+    def ready(self) -> bool:
+        return self._handlers is not None
+
+    async def timed(self, name: str, awaitable: Awaitable[T]) -> T:
+        """Await a startup step and record its duration"""
+        start_time = time.perf_counter()
+        result = await awaitable
+        self._record(name, time.perf_counter() - start_time)
+        return result
+
+    def _record(self, name: str, duration: float) -> None:
+        self.timings[name] = round(duration, 4)
+        _STARTUP_DURATION.set(duration, step=name)
+
+    async def run(
+        self, build: Callable[["Startup"], Awaitable[Dict[str, Handler]]]
+    ) -> None:
+        start_time = time.perf_counter()
+        try:
+            handlers = await build(self)
+        except Exception:
+            self._failed = True
+            logger.exception("Failed to start the bot")
+            raise
+        self._record("total", time.perf_counter() - start_time)
+        self._handlers = handlers
+        logger.info("Bot is ready: %s", json.dumps(self.timings))
+
+    def gate(self, name: str) -> Handler:
+        async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            if self._handlers is not None:
+                return await self._handlers[name](update, context)
+
+            if self._failed:
+                text = "Вибачте, бот тимчасово недоступний."
+            else:
+                text = "Бот ще запускається, спробуйте, будь ласка, за хвилину."
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                reply_to_message_id=update.effective_message.id,
+                text=text,
+            )
+
+        return handler
@@ -0,0 +1,70 @@
+import time
+
+from telegram import Bot, Message
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import BadRequest
+
+
+class ThrottledMessageEditor:
+    """Sends a placeholder message and gradually replaces its text with
+    a streamed answer. Intermediate edits are sent not more often than once
+    per `min_interval` seconds in order to stay within Telegram rate limits.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        chat_id: int,
+        reply_to_message_id: int,
+        min_interval: float = 3.0,
+    ) -> None:
+        self._bot = bot
+        self._chat_id = chat_id
+        self._reply_to_message_id = reply_to_message_id
+        self._min_interval = min_interval
+
+        self._message: Message | None = None
+        self._text = ""
+        self._shown_text = ""
+        self._last_edit_time = 0.0
+
+    async def start(self, placeholder: str = "Генерую відповідь...") -> None:
+        self._message = await self._bot.send_message(
+            chat_id=self._chat_id,
+            reply_to_message_id=self._reply_to_message_id,
+            text=placeholder,
+        )
+        self._shown_text = placeholder
+
+    async def append(self, chunk: str) -> None:
+        self._text += chunk
+        if time.monotonic() - self._last_edit_time < self._min_interval:
+            return
+
+        # partial text may contain unclosed tags, so send it without parsing
+        text = self._text.strip()[: MessageLimit.MAX_TEXT_LENGTH]
+        if len(text) > 0:
+            await self._edit(text)
+
+    async def finish(self, text: str) -> None:
+        if self._message is None:
+            await self._bot.send_message(
+                chat_id=self._chat_id,
+                reply_to_message_id=self._reply_to_message_id,
+                text=text,
+                parse_mode=ParseMode.HTML,
+            )
+        else:
+            await self._edit(text, parse_mode=ParseMode.HTML)
+
+    async def _edit(self, text: str, parse_mode: str | None = None) -> None:
+        if text == self._shown_text and parse_mode is None:
+            return
+
+        self._last_edit_time = time.monotonic()
+        try:
+            await self._message.edit_text(text, parse_mode=parse_mode)
+        except BadRequest as e:
+            if "not modified" not in e.message:
+                raise
+        self._shown_text = text
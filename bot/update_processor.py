@@ -0,0 +1,52 @@
+import asyncio
+from typing import Any, Awaitable, Dict, Hashable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different chats concurrently, but updates of one chat
+    one by one in the order they were received. At most `max_concurrent_updates`
+    updates are processed at the same time, updates waiting for the previous
+    update of their chat don't take a slot."""
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int = 1024):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer")
+        # bounds both running and waiting updates
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chat_locks: Dict[Hashable, asyncio.Lock] = {}
+        self._chat_num_updates: Dict[Hashable, int] = {}
+
+    @staticmethod
+    def _chat_id(update: object) -> Hashable | None:
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            async with self._running:
+                await coroutine
+            return
+
+        # asyncio.Lock wakes up waiters in FIFO order
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        self._chat_num_updates[chat_id] = self._chat_num_updates.get(chat_id, 0) + 1
+        try:
+            async with lock, self._running:
+                await coroutine
+        finally:
+            self._chat_num_updates[chat_id] -= 1
+            if self._chat_num_updates[chat_id] == 0:
+                del self._chat_num_updates[chat_id]
+                del self._chat_locks[chat_id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,4 @@
+from .index import BM25Index
+from .tokenizer import UkrainianTokenizer
+
+__all__ = ["BM25Index", "UkrainianTokenizer"]
@@ -0,0 +1,387 @@
+import math
+import os
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from crag.bm25.tokenizer import UkrainianTokenizer
+from crag.storage.segments import (
+    CHANGE_LOG_FILE,
+    ChangeLog,
+    DocumentsBlob,
+    current_segment_dir,
+    encode_document,
+    load_array,
+    new_segment_dir,
+    read_json,
+    switch_segment,
+    write_json,
+)
+
+
+def _add_change(
+    ids: Sequence[str], docs: Sequence[Document], tokenized: List[Counter]
+) -> Dict[str, Any]:
+    return {
+        "op": "add",
+        "ids": list(ids),
+        "docs": [
+            {"page_content": doc.page_content, "metadata": doc.metadata}
+            for doc in docs
+        ],
+        "term_freqs": [dict(term_freqs) for term_freqs in tokenized],
+    }
+
+
+@dataclass
+class _Segment:
+    vocab: Dict[str, int]
+    offsets: np.ndarray
+    postings_docs: np.ndarray
+    postings_tfs: np.ndarray
+    docs_blob: DocumentsBlob
+    ids: List[str]
+    doc_lens: np.ndarray
+
+
+@dataclass
+class _Snapshot:
+    num_docs: int
+    vocab: Dict[str, int]
+    offsets: np.ndarray
+    postings_docs: np.ndarray
+    postings_tfs: np.ndarray
+    mem_postings: Dict[str, Dict[int, int]]
+    mem_docs: Dict[int, Document]
+    docs_blob: DocumentsBlob
+    ids: List[str]
+    doc_lens: np.ndarray
+    alive: np.ndarray
+
+
+class BM25Index:
+    """Inverted index with BM25 scoring.
+
+    The index consists of a read-only segment, memory mapped from the disk, and
+    a small in-memory segment with recently added documents. Deleted documents are
+    masked out until `save`, which merges both segments into a new on-disk one.
+    With `persist_dir` changes are appended to a log of the on-disk segment and
+    `persist` merges them only once the log has `compact_threshold` changes.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Callable[[str], List[str]] | None = None,
+        k1: float = 1.5,
+        b: float = 0.75,
+        persist_dir: str | os.PathLike | None = None,
+        compact_threshold: int = 1000,
+    ) -> None:
+        self._tokenizer = tokenizer if tokenizer is not None else UkrainianTokenizer()
+        self.k1 = k1
+        self.b = b
+        self.persist_dir = Path(persist_dir) if persist_dir is not None else None
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        # only one compaction at a time, it doesn't block searches
+        self._compaction_lock = threading.Lock()
+        self._log: ChangeLog | None = None
+
+        # on-disk segment
+        self._vocab: Dict[str, int] = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._postings_docs = np.zeros(0, dtype=np.int32)
+        self._postings_tfs = np.zeros(0, dtype=np.float32)
+        self._docs_blob = DocumentsBlob.empty()
+        # in-memory segment
+        self._mem_postings: Dict[str, Dict[int, int]] = {}
+        self._mem_docs: Dict[int, Document] = {}
+        self._mem_term_freqs: Dict[int, Counter] = {}
+        # all documents, indexed by their position
+        self._ids: List[str] = []
+        self._id_to_idx: Dict[str, int] = {}
+        self._doc_lens = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+
+        if self.persist_dir is not None and current_segment_dir(self.persist_dir):
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._id_to_idx)
+
+    def add(self, docs: Sequence[Document], ids: Sequence[str]) -> None:
+        tokenized = [Counter(self._tokenizer(doc.page_content)) for doc in docs]
+        with self._lock:
+            self._add(docs, ids, tokenized)
+            if self._log is not None:
+                self._log.append([_add_change(ids, docs, tokenized)])
+
+    def _add(
+        self, docs: Sequence[Document], ids: Sequence[str], tokenized: List[Counter]
+    ) -> None:
+        doc_lens = [sum(term_freqs.values()) for term_freqs in tokenized]
+        start_idx = len(self._ids)
+        self._doc_lens = np.concatenate(
+            [self._doc_lens, np.array(doc_lens, dtype=np.float32)]
+        )
+        self._alive = np.concatenate([self._alive, np.ones(len(docs), dtype=bool)])
+        for i, (id, doc, term_freqs) in enumerate(zip(ids, docs, tokenized)):
+            idx = start_idx + i
+            # a new version of a document replaces the old one
+            self._delete([id])
+            self._ids.append(id)
+            self._id_to_idx[id] = idx
+            self._mem_docs[idx] = Document(
+                page_content=doc.page_content, metadata=doc.metadata
+            )
+            self._mem_term_freqs[idx] = term_freqs
+            for term, tf in term_freqs.items():
+                self._mem_postings.setdefault(term, {})[idx] = tf
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """Delete documents by ids. Returns the number of deleted documents"""
+        with self._lock:
+            num_deleted = self._delete(ids)
+            if num_deleted > 0 and self._log is not None:
+                self._log.append([{"op": "delete", "ids": list(ids)}])
+            return num_deleted
+
+    def _delete(self, ids: Sequence[str]) -> int:
+        num_deleted = 0
+        for id in ids:
+            idx = self._id_to_idx.pop(id, None)
+            if idx is not None:
+                self._alive[idx] = False
+                self._mem_docs.pop(idx, None)
+                self._mem_term_freqs.pop(idx, None)
+                num_deleted += 1
+        return num_deleted
+
+    def _apply_changes(self, changes: List[Dict[str, Any]]) -> None:
+        for change in changes:
+            if change["op"] == "add":
+                self._add(
+                    [Document(**doc) for doc in change["docs"]],
+                    change["ids"],
+                    [Counter(term_freqs) for term_freqs in change["term_freqs"]],
+                )
+            else:
+                self._delete(change["ids"])
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        docs, tfs = [], []
+        term_id = self._vocab.get(term)
+        if term_id is not None:
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            docs.append(self._postings_docs[start:end])
+            tfs.append(self._postings_tfs[start:end])
+        mem_postings = self._mem_postings.get(term)
+        if mem_postings:
+            docs.append(np.fromiter(mem_postings.keys(), dtype=np.int32))
+            tfs.append(np.fromiter(mem_postings.values(), dtype=np.float32))
+        if not docs:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        return np.concatenate(docs), np.concatenate(tfs)
+
+    def _get_document(self, idx: int) -> Document:
+        if idx in self._mem_docs:
+            return self._mem_docs[idx]
+        return self._docs_blob.get(idx)
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        terms = set(self._tokenizer(query))
+        with self._lock:
+            num_docs = len(self._id_to_idx)
+            if num_docs == 0 or not terms:
+                return []
+            avg_doc_len = max(float(self._doc_lens[self._alive].mean()), 1.0)
+
+            scores = np.zeros(len(self._ids), dtype=np.float32)
+            for term in terms:
+                docs, tfs = self._postings(term)
+                alive = self._alive[docs]
+                docs, tfs = docs[alive], tfs[alive]
+                if len(docs) == 0:
+                    continue
+                idf = math.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                norm = 1 - self.b + self.b * self._doc_lens[docs] / avg_doc_len
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + self.k1 * norm)
+
+            candidates = np.flatnonzero(scores > 0)
+            if len(candidates) > k:
+                top = np.argpartition(scores[candidates], -k)[-k:]
+                candidates = candidates[top]
+            candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+            return [(self._get_document(idx), float(scores[idx])) for idx in candidates]
+
+    def persist(self) -> None:
+        """Write a segment if there isn't one yet or the change log is too long"""
+        if self.persist_dir is None:
+            return
+        # changes made during a running compaction are carried over by it
+        if not self._compaction_lock.acquire(blocking=False):
+            return
+        try:
+            if self._log is None or self._log.num_changes >= self.compact_threshold:
+                self._compact(self.persist_dir)
+        finally:
+            self._compaction_lock.release()
+
+    def save(self, persist_dir: str | os.PathLike | None = None) -> None:
+        """Merge all documents into a new on-disk segment and switch to it"""
+        persist_dir = Path(persist_dir) if persist_dir is not None else self.persist_dir
+        if persist_dir is None:
+            raise ValueError("persist_dir isn't specified")
+
+        with self._compaction_lock:
+            self._compact(persist_dir)
+
+    def _compact(self, persist_dir: Path) -> None:
+        with self._lock:
+            snapshot = _Snapshot(
+                num_docs=len(self._ids),
+                vocab=self._vocab,
+                offsets=self._offsets,
+                postings_docs=self._postings_docs,
+                postings_tfs=self._postings_tfs,
+                mem_postings={
+                    term: dict(postings)
+                    for term, postings in self._mem_postings.items()
+                },
+                mem_docs=dict(self._mem_docs),
+                docs_blob=self._docs_blob,
+                ids=list(self._ids),
+                doc_lens=self._doc_lens,
+                alive=self._alive.copy(),
+            )
+        # the segment is written without the lock, so searches go on
+        segment_dir = new_segment_dir(persist_dir)
+        self._write_segment(segment_dir, snapshot)
+        segment = self._read_segment(segment_dir)
+
+        with self._lock:
+            changes = self._changes_since(snapshot)
+            log = ChangeLog(segment_dir / CHANGE_LOG_FILE)
+            log.append(changes)
+            switch_segment(persist_dir, segment_dir)
+            self.persist_dir = persist_dir
+            self._set_segment(segment, changes, log)
+
+    def _changes_since(self, snapshot: _Snapshot) -> List[Dict[str, Any]]:
+        """Changes made after the snapshot: deletions of its documents and
+        documents added after it, which are still alive"""
+        changes = []
+        num_docs = snapshot.num_docs
+        deleted_idxs = np.flatnonzero(snapshot.alive & ~self._alive[:num_docs])
+        if len(deleted_idxs) > 0:
+            changes.append(
+                {"op": "delete", "ids": [self._ids[idx] for idx in deleted_idxs]}
+            )
+
+        added_idxs = num_docs + np.flatnonzero(self._alive[num_docs:])
+        if len(added_idxs) > 0:
+            changes.append(
+                _add_change(
+                    [self._ids[idx] for idx in added_idxs],
+                    [self._mem_docs[idx] for idx in added_idxs],
+                    [self._mem_term_freqs[idx] for idx in added_idxs],
+                )
+            )
+        return changes
+
+    def _write_segment(self, segment_dir: Path, snapshot: _Snapshot) -> None:
+        alive_idxs = np.flatnonzero(snapshot.alive)
+        new_idxs = np.cumsum(snapshot.alive, dtype=np.int64) - 1
+
+        # postings of both segments as (term, doc, tf) triples
+        terms = list(snapshot.vocab.keys())
+        term_ids = [
+            np.repeat(
+                np.arange(len(terms), dtype=np.int64), np.diff(snapshot.offsets)
+            )
+        ]
+        docs = [np.asarray(snapshot.postings_docs, dtype=np.int64)]
+        tfs = [np.asarray(snapshot.postings_tfs)]
+        for term, postings in snapshot.mem_postings.items():
+            term_id = snapshot.vocab.get(term)
+            if term_id is None:
+                term_id = len(terms)
+                terms.append(term)
+            term_ids.append(np.full(len(postings), term_id, dtype=np.int64))
+            docs.append(np.fromiter(postings.keys(), dtype=np.int64))
+            tfs.append(np.fromiter(postings.values(), dtype=np.float32))
+        term_ids, docs, tfs = map(np.concatenate, (term_ids, docs, tfs))
+
+        alive = snapshot.alive[docs]
+        term_ids, docs, tfs = term_ids[alive], new_idxs[docs[alive]], tfs[alive]
+        order = np.lexsort((docs, term_ids))
+        term_ids, docs, tfs = term_ids[order], docs[order], tfs[order]
+        # drop terms which left only in deleted documents
+        used_terms, term_ids = np.unique(term_ids, return_inverse=True)
+        offsets = np.zeros(len(used_terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(used_terms)), out=offsets[1:])
+
+        DocumentsBlob.write(
+            segment_dir,
+            (
+                (
+                    encode_document(snapshot.mem_docs[idx])
+                    if idx in snapshot.mem_docs
+                    else snapshot.docs_blob.raw(idx)
+                )
+                for idx in alive_idxs
+            ),
+        )
+        np.save(segment_dir / "offsets.npy", offsets)
+        np.save(segment_dir / "postings_docs.npy", docs.astype(np.int32))
+        np.save(segment_dir / "postings_tfs.npy", tfs.astype(np.float32))
+        np.save(segment_dir / "doc_lens.npy", snapshot.doc_lens[alive_idxs])
+        write_json(segment_dir / "vocab.json", [terms[i] for i in used_terms])
+        write_json(segment_dir / "ids.json", [snapshot.ids[i] for i in alive_idxs])
+
+    def load(self) -> None:
+        segment_dir = current_segment_dir(self.persist_dir)
+        segment = self._read_segment(segment_dir)
+        log = ChangeLog(segment_dir / CHANGE_LOG_FILE)
+        changes = log.read()
+        with self._lock:
+            self._set_segment(segment, changes, log)
+
+    def _read_segment(self, segment_dir: Path) -> _Segment:
+        terms = read_json(segment_dir / "vocab.json")
+        return _Segment(
+            vocab={term: i for i, term in enumerate(terms)},
+            offsets=load_array(segment_dir / "offsets.npy"),
+            postings_docs=load_array(segment_dir / "postings_docs.npy"),
+            postings_tfs=load_array(segment_dir / "postings_tfs.npy"),
+            docs_blob=DocumentsBlob.load(segment_dir),
+            ids=read_json(segment_dir / "ids.json"),
+            doc_lens=load_array(segment_dir / "doc_lens.npy"),
+        )
+
+    def _set_segment(
+        self, segment: _Segment, changes: List[Dict[str, Any]], log: ChangeLog
+    ) -> None:
+        self._vocab = segment.vocab
+        self._offsets = segment.offsets
+        self._postings_docs = segment.postings_docs
+        self._postings_tfs = segment.postings_tfs
+        self._docs_blob = segment.docs_blob
+        self._mem_postings = {}
+        self._mem_docs = {}
+        self._mem_term_freqs = {}
+        self._ids = segment.ids
+        self._id_to_idx = {id: idx for idx, id in enumerate(segment.ids)}
+        self._doc_lens = segment.doc_lens
+        self._alive = np.ones(len(segment.ids), dtype=bool)
+        self._apply_changes(changes)
+
+        if self._log is not None:
+            self._log.close()
+        self._log = log
@@ -0,0 +1,90 @@
+import re
+from functools import lru_cache
+from typing import List
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_APOSTROPHES_RE = re.compile(r"['’ʼ`]")
+_CYRILLIC_RE = re.compile(r"[а-яґєії]")
+
+_VOWELS = "аеиоуюяієї"
+_RV_RE = re.compile(rf"^(.*?[{_VOWELS}])(.*)$")
+
+# light suffix stripping stemmer for Ukrainian, the groups of endings follow
+# the Porter-like stemmer by Tochilkin & co
+_PERFECTIVE_GERUND_RE = re.compile(r"(ив|ивши|ившись|(?<=[ая])(в|вши|вшись))$")
+_REFLEXIVE_RE = re.compile(r"(с[яьи])$")
+_ADJECTIVE_RE = re.compile(
+    r"(ими|ій|ий|а|е|ова|ове|ів|є|їй|єє|еє|я|ім|ем|им|их|іх|ою|йми|іми|у|ю"
+    r"|ого|ому|ої)$"
+)
+_PARTICIPLE_RE = re.compile(r"(ий|ого|ому|им|ім|а|ій|у|ою|і|их|йми)$")
+_VERB_RE = re.compile(r"(сь|ся|ив|ать|ять|у|ю|ав|али|учи|ячи|вши|ши|е|ме|ати|яти|є)$")
+_NOUN_RE = re.compile(
+    r"(а|ев|ов|е|ями|ами|еи|и|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ь|ию|ью|ю"
+    r"|ия|ья|я|і|ові|ї|ею|єю|ою|є|еві|єм|ів|їв|ія|ії|ію|ією|іям|іями|іях)$"
+)
+_DERIVATIONAL_RE = re.compile(
+    rf"[^{_VOWELS}][{_VOWELS}]+[^{_VOWELS}]+[{_VOWELS}].*ість?$"
+)
+
+STOP_WORDS = frozenset(
+    """
+    а або але б би бо був була були було бути в вам вас ваш ви від він вона вони
+    воно все всі втім вже де для до є ж же з за зі і із її їй їх й його йому
+    коли ким лише мене мені ми мій на навіть над нам нас наш не ні ніж них ну о
+    об однак окрім по при про під саме свій себе собі та так також там те ти то
+    тобі тоді того той тому ту тут у усі хто це цей ці цю ця цього чи чий чим що
+    щоб щодо як яка які який якщо
+    """.split()
+)
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """Strip inflectional endings from a lowercased Ukrainian word"""
+    match = _RV_RE.match(word)
+    if match is None:
+        return word
+    start, rv = match.groups()
+
+    rv, num_subs = _PERFECTIVE_GERUND_RE.subn("", rv, count=1)
+    if num_subs == 0:
+        rv = _REFLEXIVE_RE.sub("", rv, count=1)
+        rv, num_subs = _ADJECTIVE_RE.subn("", rv, count=1)
+        if num_subs > 0:
+            rv = _PARTICIPLE_RE.sub("", rv, count=1)
+        else:
+            rv, num_subs = _VERB_RE.subn("", rv, count=1)
+            if num_subs == 0:
+                rv = _NOUN_RE.sub("", rv, count=1)
+
+    if rv.endswith("и"):
+        rv = rv[:-1]
+    if _DERIVATIONAL_RE.search(rv):
+        rv = re.sub(r"ість?$", "", rv)
+    if rv.endswith("ь"):
+        rv = rv[:-1]
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+
+    return start + rv
+
+
+class UkrainianTokenizer:
+    """Splits a text into lowercased, stemmed tokens without stop words.
+    Non Cyrillic tokens (numbers, latin abbreviations) are kept as is."""
+
+    def __init__(self, min_token_len: int = 1, use_stemmer: bool = True) -> None:
+        self.min_token_len = min_token_len
+        self.use_stemmer = use_stemmer
+
+    def __call__(self, text: str) -> List[str]:
+        text = _APOSTROPHES_RE.sub("", text.lower())
+        tokens = []
+        for token in _TOKEN_RE.findall(text):
+            if token in STOP_WORDS or len(token) < self.min_token_len:
+                continue
+            if self.use_stemmer and _CYRILLIC_RE.search(token):
+                token = stem(token)
+            tokens.append(token)
+        return tokens
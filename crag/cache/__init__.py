@@ -0,0 +1,9 @@
+from .coalescing import RequestCoalescer, normalize_question
+from .semantic_cache import CacheInvalidatingRetriever, SemanticAnswerCache
+
+__all__ = [
+    "SemanticAnswerCache",
+    "CacheInvalidatingRetriever",
+    "RequestCoalescer",
+    "normalize_question",
+]
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Generic, Hashable, List, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+Listener = Callable[[str], Awaitable[None]]
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+@dataclass
+class _InFlightRequest(Generic[T]):
+    task: asyncio.Task | None = None
+    # number of requests awaiting the result
+    num_waiters: int = 0
+    listeners: List[Listener] = field(default_factory=list)
+    # streamed chunks, replayed to listeners which join later
+    chunks: List[str] = field(default_factory=list)
+
+
+class RequestCoalescer(Generic[T]):
+    """Runs only one request per key at a time. Concurrent requests with the
+    same key await the result of the in-flight one instead of starting a new
+    computation. Streamed chunks of the in-flight request are forwarded to the
+    listeners of all coalesced requests. The computation runs in its own task,
+    which is cancelled only when all requests awaiting it are cancelled."""
+
+    def __init__(self) -> None:
+        self._in_flight: Dict[Hashable, _InFlightRequest[T]] = {}
+        self.num_coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    async def run(
+        self,
+        key: Hashable,
+        func: Callable[[Listener], Awaitable[T]],
+        listener: Listener | None = None,
+    ) -> T:
+        """Run `func` or join its in-flight run with the same key. `func` gets
+        a callback which broadcasts a streamed chunk to all listeners."""
+        request = self._in_flight.get(key)
+        if request is None:
+            request = self._start(key, func)
+        else:
+            self.num_coalesced += 1
+
+        request.num_waiters += 1
+        try:
+            if listener is not None:
+                for chunk in request.chunks:
+                    await self._notify(listener, chunk)
+                request.listeners.append(listener)
+            # a cancelled request must not cancel the computation for others
+            return await asyncio.shield(request.task)
+        finally:
+            request.num_waiters -= 1
+            if listener is not None and listener in request.listeners:
+                request.listeners.remove(listener)
+            if request.num_waiters == 0 and not request.task.done():
+                request.task.cancel()
+
+    def _start(
+        self, key: Hashable, func: Callable[[Listener], Awaitable[T]]
+    ) -> _InFlightRequest[T]:
+        request = _InFlightRequest()
+
+        async def broadcast(chunk: str) -> None:
+            request.chunks.append(chunk)
+            for listener in list(request.listeners):
+                await self._notify(listener, chunk)
+
+        def finish(task: asyncio.Task) -> None:
+            if self._in_flight.get(key) is request:
+                del self._in_flight[key]
+            # don't complain about an exception nobody else waited for
+            if not task.cancelled():
+                task.exception()
+
+        request.task = asyncio.ensure_future(func(broadcast))
+        request.task.add_done_callback(finish)
+        self._in_flight[key] = request
+        return request
+
+    @staticmethod
+    async def _notify(listener: Listener, chunk: str) -> None:
+        try:
+            await listener(chunk)
+        except Exception:
+            # a failed listener must not break the request for other ones
+            logger.exception("Failed to pass a streamed chunk to a listener")
@@ -0,0 +1,175 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.indexing.api import IndexingResult
+
+from crag.retrievers.base import PipelineRetrieverBase
+
+
+@dataclass(frozen=True)
+class CacheKey:
+    embedding: np.ndarray
+    question: str
+    only_docs: bool
+    version: int
+
+
+@dataclass
+class CacheEntry:
+    embedding: np.ndarray
+    question: str
+    only_docs: bool
+    response: Dict[str, Any]
+    created_at: float
+
+
+class SemanticAnswerCache:
+    """Size bounded LRU cache with TTL eviction of pipeline responses keyed by
+    a question embedding. A stored response is served if a new question is
+    close enough (in terms of cosine similarity) to an already answered one.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        similarity_threshold: float = 0.92,
+        max_size: int = 512,
+        ttl: float | None = None,
+    ) -> None:
+        self._embeddings = embeddings
+        self._similarity_threshold = similarity_threshold
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries: OrderedDict[int, CacheEntry] = OrderedDict()
+        self._next_entry_id = 0
+        # incremented on every invalidation in order to not store responses
+        # computed concurrently with a knowledge base update
+        self._version = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def akey(self, question: str, only_docs: bool) -> CacheKey:
+        embedding = np.asarray(
+            await self._embeddings.aembed_query(question), dtype=np.float32
+        )
+        norm = np.linalg.norm(embedding)
+        if norm > 0:
+            embedding = embedding / norm
+        return CacheKey(embedding, question, only_docs, self._version)
+
+    def get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        self._evict_expired()
+
+        entry_ids = [
+            id
+            for id, entry in self._entries.items()
+            if entry.only_docs == key.only_docs
+        ]
+        if len(entry_ids) == 0:
+            return None
+
+        cached_embeddings = np.stack([self._entries[id].embedding for id in entry_ids])
+        similarities = cached_embeddings @ key.embedding
+        best_idx = int(np.argmax(similarities))
+        if similarities[best_idx] < self._similarity_threshold:
+            return None
+
+        entry_id = entry_ids[best_idx]
+        self._entries.move_to_end(entry_id)
+        entry = self._entries[entry_id]
+
+        response = dict(entry.response)
+        # the question has not been rewritten by the pipeline, so report
+        # the actual one in order to not confuse a user
+        if response["question"] == entry.question:
+            response["question"] = key.question
+        return response
+
+    def put(self, key: CacheKey, response: Dict[str, Any]) -> None:
+        if key.version != self._version:
+            return
+
+        self._entries[self._next_entry_id] = CacheEntry(
+            embedding=key.embedding,
+            question=key.question,
+            only_docs=key.only_docs,
+            response={
+                "question": response["question"],
+                "generation": response.get("generation"),
+                "documents": list(response["documents"]),
+                "failed": response["failed"],
+            },
+            created_at=time.monotonic(),
+        )
+        self._next_entry_id += 1
+
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """Remove all entries. Any addition or deletion of a document
+        can change the retrieval result for an arbitrary question, so all
+        stored responses are considered as affected."""
+        self._entries.clear()
+        self._version += 1
+
+    def _evict_expired(self) -> None:
+        if self._ttl is None:
+            return
+
+        now = time.monotonic()
+        expired_ids = [
+            id
+            for id, entry in self._entries.items()
+            if now - entry.created_at > self._ttl
+        ]
+        for id in expired_ids:
+            del self._entries[id]
+
+
+class CacheInvalidatingRetriever(PipelineRetrieverBase):
+    """Wrapper around a pipeline retriever that invalidates an answer cache
+    every time documents are added to or deleted from the underlying store"""
+
+    def __init__(
+        self, pipe_retriever: PipelineRetrieverBase, cache: SemanticAnswerCache
+    ) -> None:
+        super().__init__()
+        self._pipe_retriever = pipe_retriever
+        self._cache = cache
+
+    @property
+    def retriever(self):
+        return self._pipe_retriever.retriever
+
+    @property
+    def embeddings(self) -> Embeddings | None:
+        return self._pipe_retriever.embeddings
+
+    @property
+    def supports_incremental_update(self) -> bool:
+        return self._pipe_retriever.supports_incremental_update
+
+    async def aadd_documents(self, docs: List[Document], **kwargs) -> List[str]:
+        try:
+            return await self._pipe_retriever.aadd_documents(docs, **kwargs)
+        finally:
+            self._cache.invalidate()
+
+    async def adelete_documents(self, ids: List[str], **kwargs) -> bool | None:
+        try:
+            return await self._pipe_retriever.adelete_documents(ids, **kwargs)
+        finally:
+            self._cache.invalidate()
+
+    async def aupdate_documents(self, docs: List[Document], **kwargs) -> IndexingResult:
+        try:
+            return await self._pipe_retriever.aupdate_documents(docs, **kwargs)
+        finally:
+            self._cache.invalidate()
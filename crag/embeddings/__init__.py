@@ -0,0 +1,3 @@
+from .cached import CachedEmbeddings
+
+__all__ = ["CachedEmbeddings"]
@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional
+
+from diskcache import Cache
+from langchain_core.embeddings import Embeddings
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    disk_hits: int
+    misses: int
+    size: int
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that memoizes query embeddings in an in-memory LRU
+    cache and optionally in a persistent on-disk cache that survives restarts.
+    Document embeddings are always computed by the underlying model.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_size: int = 1024,
+        cache_dir: str | None = None,
+        namespace: str | None = None,
+    ) -> None:
+        self._embeddings = embeddings
+        self._max_size = max_size
+        self._memory: OrderedDict[str, List[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = Cache(cache_dir) if cache_dir is not None else None
+
+        # the same text embedded by different models should not collide
+        if namespace is None:
+            namespace = getattr(embeddings, "model_name", type(embeddings).__name__)
+        self._namespace = namespace
+
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embeddings
+
+    def cache_info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(
+                self._hits, self._disk_hits, self._misses, len(self._memory)
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._make_key(text)
+        embedding = self._lookup_memory(key)
+        if embedding is None:
+            embedding = self._lookup_disk(key)
+        if embedding is None:
+            embedding = self._embeddings.embed_query(text)
+            self._store_to_memory(key, embedding)
+            self._store_to_disk(key, embedding)
+        return embedding
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._make_key(text)
+        embedding = self._lookup_memory(key)
+        # the disk tier does file and SQLite I/O, so it must not block the loop
+        if embedding is None and self._disk is not None:
+            embedding = await asyncio.to_thread(self._lookup_disk, key)
+        elif embedding is None:
+            embedding = self._lookup_disk(key)
+        if embedding is None:
+            embedding = await self._embeddings.aembed_query(text)
+            self._store_to_memory(key, embedding)
+            if self._disk is not None:
+                await asyncio.to_thread(self._store_to_disk, key, embedding)
+        return embedding
+
+    def _make_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self._namespace}\0{text}".encode()).hexdigest()
+
+    def _lookup_memory(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                self._hits += 1
+            return embedding
+
+    def _lookup_disk(self, key: str) -> Optional[List[float]]:
+        """Look up the disk tier after a memory miss, counts the final miss"""
+        embedding = self._disk.get(key) if self._disk is not None else None
+        with self._lock:
+            if embedding is not None:
+                self._disk_hits += 1
+                self._put_to_memory(key, embedding)
+            else:
+                self._misses += 1
+        return embedding
+
+    def _store_to_memory(self, key: str, embedding: List[float]) -> None:
+        with self._lock:
+            self._put_to_memory(key, embedding)
+
+    def _store_to_disk(self, key: str, embedding: List[float]) -> None:
+        if self._disk is not None:
+            self._disk.set(key, embedding)
+
+    def _put_to_memory(self, key: str, embedding: List[float]) -> None:
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_size:
+            self._memory.popitem(last=False)
@@ -0,0 +1,141 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import onnxruntime as ort
+from langchain_core.embeddings import Embeddings
+from tokenizers import Tokenizer
+
+MODEL_FILE = "model_quantized.onnx"
+CONFIG_FILE = "embedding_config.json"
+
+
+def export_onnx(model_dir: str, output_dir: str, opset: int = 14) -> None:
+    """Export the transformer of a sentence-transformers model with mean pooling
+    to ONNX and quantize its weights to int8 (dynamic quantization)"""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    model_path = Path(model_dir)
+    pooling_config = json.loads((model_path / "1_Pooling" / "config.json").read_text())
+    if not pooling_config.get("pooling_mode_mean_tokens", False):
+        raise ValueError("Only models with mean pooling are supported")
+    st_config = json.loads((model_path / "sentence_bert_config.json").read_text())
+    modules = json.loads((model_path / "modules.json").read_text())
+
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = AutoModel.from_pretrained(model_dir).eval()
+
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    inputs = tokenizer(["Приклад речення"], return_tensors="pt")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fp32_path = os.path.join(tmp_dir, "model.onnx")
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (inputs["input_ids"], inputs["attention_mask"]),
+                fp32_path,
+                input_names=["input_ids", "attention_mask"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "last_hidden_state": {0: "batch", 1: "sequence"},
+                },
+                opset_version=opset,
+            )
+        quantize_dynamic(
+            fp32_path, str(output_path / MODEL_FILE), weight_type=QuantType.QInt8
+        )
+
+    tokenizer.save_pretrained(output_dir)
+    config = {
+        "max_seq_length": st_config["max_seq_length"],
+        "normalize": any(m["type"].endswith("Normalize") for m in modules),
+    }
+    (output_path / CONFIG_FILE).write_text(json.dumps(config))
+
+
+class OnnxEmbeddings(Embeddings):
+    """Sentence embeddings computed by an int8 quantized ONNX export of
+    a sentence-transformers model (see `export_onnx`) with onnxruntime on CPU.
+    Texts are sorted by length before batching, so batches are padded only to
+    the length of their longest text."""
+
+    def __init__(
+        self,
+        model_name: str,
+        batch_size: int = 32,
+        intra_op_threads: int | None = None,
+    ) -> None:
+        model_path = Path(model_name)
+        # also used as a namespace of cached embeddings
+        self.model_name = model_name
+        self.batch_size = batch_size
+
+        config = json.loads((model_path / CONFIG_FILE).read_text())
+        self._normalize = config["normalize"]
+        self._tokenizer = Tokenizer.from_file(str(model_path / "tokenizer.json"))
+        self._tokenizer.enable_truncation(config["max_seq_length"])
+        self._tokenizer.no_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads is not None:
+            options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        self._session = ort.InferenceSession(
+            str(model_path / MODEL_FILE),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._pad_id = self._tokenizer.token_to_id("<pad>") or 0
+
+    def _embed_batch(self, encodings: list) -> np.ndarray:
+        max_len = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.full((len(encodings), max_len), self._pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), max_len), dtype=np.int64)
+        for i, encoding in enumerate(encodings):
+            input_ids[i, : len(encoding.ids)] = encoding.ids
+            attention_mask[i, : len(encoding.ids)] = 1
+
+        (hidden_state,) = self._session.run(
+            ["last_hidden_state"],
+            {"input_ids": input_ids, "attention_mask": attention_mask},
+        )
+        # mean pooling over non padding tokens
+        mask = attention_mask[..., None].astype(np.float32)
+        embeddings = (hidden_state * mask).sum(axis=1) / np.clip(
+            mask.sum(axis=1), 1e-9, None
+        )
+        if self._normalize:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        if len(texts) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        encodings = self._tokenizer.encode_batch(texts)
+        order = np.argsort([len(encoding.ids) for encoding in encodings])
+        embeddings = None
+        for start in range(0, len(order), self.batch_size):
+            idxs = order[start : start + self.batch_size]
+            batch_embeddings = self._embed_batch([encodings[i] for i in idxs])
+            if embeddings is None:
+                embeddings = np.empty(
+                    (len(texts), batch_embeddings.shape[1]), dtype=np.float32
+                )
+            embeddings[idxs] = batch_embeddings
+        return embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0].tolist()
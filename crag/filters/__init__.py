@@ -0,0 +1,3 @@
+from .base import RelevanceFilterBase
+
+__all__ = ["RelevanceFilterBase"]
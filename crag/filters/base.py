@@ -0,0 +1,12 @@
+from abc import ABC, abstractmethod
+from typing import List
+
+from langchain_core.documents import Document
+
+
+class RelevanceFilterBase(ABC):
+    """Filters out documents which are irrelevant to a question"""
+
+    @abstractmethod
+    async def afilter(self, question: str, documents: List[Document]) -> List[Document]:
+        pass
@@ -0,0 +1,45 @@
+import asyncio
+import threading
+from typing import List
+
+from langchain_core.documents import Document
+from sentence_transformers import CrossEncoder
+
+from crag.filters.base import RelevanceFilterBase
+
+
+class CrossEncoderRelevanceFilter(RelevanceFilterBase):
+    """Scores (question, document) pairs with a cross-encoder model in batches
+    and keeps documents with a relevance score not lower than the threshold.
+    It replaces one LLM generation per document with a single forward pass of
+    a small encoder only model."""
+
+    def __init__(
+        self,
+        model_name: str,
+        threshold: float = 0.5,
+        batch_size: int = 16,
+        max_length: int = 512,
+        device: str = "cpu",
+    ) -> None:
+        self._model = CrossEncoder(model_name, max_length=max_length, device=device)
+        self.threshold = threshold
+        self.batch_size = batch_size
+        # torch inference is already multithreaded, run one batch at a time
+        self._lock = threading.Lock()
+
+    def scores(self, question: str, documents: List[Document]) -> List[float]:
+        if len(documents) == 0:
+            return []
+        pairs = [(question, doc.page_content) for doc in documents]
+        with self._lock:
+            scores = self._model.predict(
+                pairs, batch_size=self.batch_size, show_progress_bar=False
+            )
+        return [float(score) for score in scores]
+
+    async def afilter(self, question: str, documents: List[Document]) -> List[Document]:
+        scores = await asyncio.to_thread(self.scores, question, documents)
+        return [
+            doc for doc, score in zip(documents, scores) if score >= self.threshold
+        ]
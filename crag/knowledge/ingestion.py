@@ -0,0 +1,357 @@
+"""Concurrent bulk ingestion of documents into a knowledge base. Batches of
+sources are loaded, split and stored by separate stages connected with bounded
+queues, so pages are downloaded while the previous ones are being embedded."""
+
+import asyncio
+import hashlib
+import inspect
+import json
+import logging
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Set,
+    Tuple,
+)
+
+from langchain_core.documents import Document
+
+from crag.knowledge.loaders.http_client import afetch
+from crag.knowledge.transformations.sequence import TransformationSequence
+from crag.retrievers.base import PipelineRetrieverBase
+
+logger = logging.getLogger(__name__)
+
+_SITEMAP_NS = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+
+
+@dataclass
+class SourceItem:
+    # key of the item in a checkpoint
+    key: str
+    # items of one group (chunks of a page) are stored together, since
+    # incremental updates delete documents vanished from a source
+    group: str
+    url: str | None = None
+    doc: Document | None = None
+
+
+def _is_url(location: str) -> bool:
+    return location.startswith("http://") or location.startswith("https://")
+
+
+def read_url_list(path: str) -> Iterator[SourceItem]:
+    """Text file with an URL per line, empty lines and # comments are skipped"""
+    with open(path) as f:
+        for line in f:
+            url = line.strip()
+            if len(url) > 0 and not url.startswith("#"):
+                yield SourceItem(key=url, group=url, url=url)
+
+
+def read_facts(path: str) -> Iterator[SourceItem]:
+    """JSONL file of documents with `page_content` and `metadata` fields"""
+    with open(path) as f:
+        for line in f:
+            if len(line.strip()) == 0:
+                continue
+            doc = Document(**json.loads(line))
+            key = f"{path}:{hashlib.sha1(line.strip().encode()).hexdigest()}"
+            # facts are only deduplicated, so each one is a group on its own
+            yield SourceItem(key=key, group=key, doc=doc)
+
+
+def parse_sitemap(xml: str) -> Tuple[List[str], List[str]]:
+    """Return URLs of pages and nested sitemaps listed in a sitemap"""
+    root = ET.fromstring(xml)
+    locs = [loc.text.strip() for loc in root.iter(f"{_SITEMAP_NS}loc") if loc.text]
+    if root.tag == f"{_SITEMAP_NS}sitemapindex":
+        return [], locs
+    return locs, []
+
+
+async def aread_sitemap(location: str) -> List[SourceItem]:
+    """Pages of a sitemap (local file or URL), nested sitemaps are followed"""
+    pending, visited, items = [location], set(), []
+    while len(pending) > 0:
+        location = pending.pop()
+        if location in visited:
+            continue
+        visited.add(location)
+
+        if _is_url(location):
+            xml = await afetch(location)
+        else:
+            xml = Path(location).read_text()
+        urls, sitemaps = parse_sitemap(xml)
+        items.extend(SourceItem(key=url, group=url, url=url) for url in urls)
+        pending.extend(sitemaps)
+    return items
+
+
+async def aread_sources(sources: Iterable[str]) -> List[SourceItem]:
+    """Expand sources into items: `.jsonl` files of facts, sitemaps (`.xml` files
+    or URLs), text files with URL lists or URLs of single pages"""
+    items: Dict[str, SourceItem] = {}
+    for source in sources:
+        if source.endswith(".jsonl"):
+            new_items = list(read_facts(source))
+        elif source.endswith(".xml"):
+            new_items = await aread_sitemap(source)
+        elif _is_url(source):
+            new_items = [SourceItem(key=source, group=source, url=source)]
+        else:
+            new_items = list(read_url_list(source))
+        for item in new_items:
+            items.setdefault(item.key, item)
+    return list(items.values())
+
+
+class IngestionCheckpoint:
+    """Keys of ingested items appended to a JSONL file after every stored batch,
+    so an interrupted ingestion can be resumed"""
+
+    def __init__(self, path: str | None = None) -> None:
+        self._path = Path(path) if path is not None else None
+        self.done: Set[str] = set()
+        # the last line may be cut off by an interrupted run
+        self._cut_off = False
+        if self._path is not None and self._path.exists():
+            text = self._path.read_text()
+            self._cut_off = len(text) > 0 and not text.endswith("\n")
+            for line in text.splitlines():
+                try:
+                    self.done.add(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning("Skipped a broken line of the checkpoint")
+
+    def mark_done(self, keys: Iterable[str]) -> None:
+        new_keys = [key for key in keys if key not in self.done]
+        self.done.update(new_keys)
+        if self._path is None or len(new_keys) == 0:
+            return
+
+        lines = "".join(json.dumps(key) + "\n" for key in new_keys)
+        if self._cut_off:
+            lines = "\n" + lines
+            self._cut_off = False
+        with open(self._path, "a") as f:
+            f.write(lines)
+
+
+@dataclass
+class StageStats:
+    num_batches: int = 0
+    num_docs: int = 0
+    num_failed_batches: int = 0
+    first_start: float | None = None
+    last_end: float | None = None
+
+    @property
+    def docs_per_second(self) -> float:
+        # stage didn't process any batch successfully
+        if self.last_end is None or self.last_end == self.first_start:
+            return 0.0
+        return self.num_docs / (self.last_end - self.first_start)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "batches": self.num_batches,
+            "failed_batches": self.num_failed_batches,
+            "docs": self.num_docs,
+            "docs_per_second": round(self.docs_per_second, 2),
+        }
+
+
+@dataclass
+class _Batch:
+    keys: List[str]
+    urls: List[str] = field(default_factory=list)
+    docs: List[Document] = field(default_factory=list)
+
+
+UrlLoader = Callable[[List[str]], List[Document] | Awaitable[List[Document]]]
+
+
+class IngestionPipeline:
+    """Loads, splits and stores batches of sources. Every stage runs its own
+    workers, stages are connected with bounded queues. A failed batch is logged
+    and skipped, it isn't marked as done, so it is retried on the next run. URLs
+    are loaded separately, the ones which failed are reported and retried the
+    same way."""
+
+    STAGES = ("load", "split", "store")
+
+    def __init__(
+        self,
+        url_loader: UrlLoader,
+        doc_transformator: TransformationSequence,
+        pipe_retriever: PipelineRetrieverBase,
+        checkpoint: IngestionCheckpoint | None = None,
+        batch_size: int = 16,
+        concurrency: Dict[str, int] | None = None,
+        queue_size: int = 4,
+    ) -> None:
+        self._url_loader = url_loader
+        self._doc_transformator = doc_transformator
+        self._pipe_retriever = pipe_retriever
+        self._checkpoint = checkpoint or IngestionCheckpoint()
+        self._batch_size = batch_size
+        self._concurrency = {"load": 2, "split": 2, "store": 1} | (concurrency or {})
+        self._queue_size = queue_size
+        self.stats = {stage: StageStats() for stage in self.STAGES}
+        self.failed_urls: List[str] = []
+
+    def _batches(self, items: List[SourceItem]) -> Iterator[_Batch]:
+        groups: Dict[str, List[SourceItem]] = {}
+        for item in items:
+            groups.setdefault(item.group, []).append(item)
+
+        # pages and facts are stored differently, so they aren't batched together
+        batches = {True: _Batch(keys=[]), False: _Batch(keys=[])}
+        for group in groups.values():
+            is_page = group[0].url is not None
+            batch = batches[is_page]
+            for item in group:
+                batch.keys.append(item.key)
+                if is_page:
+                    batch.urls.append(item.url)
+                else:
+                    batch.docs.append(item.doc)
+            if len(batch.keys) >= self._batch_size:
+                yield batch
+                batches[is_page] = _Batch(keys=[])
+        for batch in batches.values():
+            if len(batch.keys) > 0:
+                yield batch
+
+    async def _load_url(self, url: str) -> List[Document]:
+        if inspect.iscoroutinefunction(self._url_loader):
+            return await self._url_loader([url])
+        return await asyncio.to_thread(self._url_loader, [url])
+
+    async def _load(
+        self, batch: _Batch, docs: List[Document] | None
+    ) -> List[Document]:
+        docs = list(batch.docs)
+        if len(batch.urls) == 0:
+            return docs
+
+        # URLs are loaded one by one, so a bad URL doesn't fail the whole batch
+        results = await asyncio.gather(
+            *(self._load_url(url) for url in batch.urls), return_exceptions=True
+        )
+        loaded_urls = []
+        for url, result in zip(batch.urls, results):
+            if isinstance(result, Exception):
+                self.failed_urls.append(url)
+                logger.error("Failed to load %s", url, exc_info=result)
+            else:
+                loaded_urls.append(url)
+                docs += result
+        if len(loaded_urls) == 0:
+            raise RuntimeError("None of the URLs of the batch has been loaded")
+
+        # failed URLs aren't marked as done, so they are retried on the next run
+        batch.keys = [key for key in batch.keys if key in loaded_urls]
+        batch.urls = loaded_urls
+        return docs
+
+    async def _split(self, batch: _Batch, docs: List[Document]) -> List[Document]:
+        return await asyncio.to_thread(self._doc_transformator.apply, docs)
+
+    async def _store(self, batch: _Batch, docs: List[Document]) -> List[Document]:
+        if self._pipe_retriever.supports_incremental_update:
+            # skip unchanged chunks, so a retried batch isn't stored twice.
+            # Vanished chunks are deleted only for pages: facts of different
+            # files (or without a source) must not delete each other or pages
+            await self._pipe_retriever.aupdate_documents(
+                docs, cleanup=len(batch.urls) > 0
+            )
+        else:
+            await self._pipe_retriever.aadd_documents(docs)
+        return docs
+
+    async def _worker(
+        self,
+        stage: str,
+        func: Callable[[_Batch, List[Document] | None], Awaitable[List[Document]]],
+        input_queue: asyncio.Queue,
+        output_queue: asyncio.Queue | None,
+    ) -> None:
+        stats = self.stats[stage]
+        while True:
+            batch, docs = await input_queue.get()
+            start_time = time.perf_counter()
+            if stats.first_start is None:
+                stats.first_start = start_time
+            try:
+                docs = await func(batch, docs)
+            except Exception:
+                stats.num_failed_batches += 1
+                logger.exception("Failed to %s a batch of %s", stage, batch.keys)
+            else:
+                stats.num_batches += 1
+                stats.num_docs += len(docs)
+                stats.last_end = time.perf_counter()
+                if output_queue is not None:
+                    await output_queue.put((batch, docs))
+                else:
+                    self._checkpoint.mark_done(batch.keys)
+            finally:
+                input_queue.task_done()
+
+    async def arun(
+        self, items: List[SourceItem]
+    ) -> Dict[str, Dict[str, float] | List[str]]:
+        """Ingest items which haven't been ingested yet, return stats of stages
+        and URLs which failed to load"""
+        pending = [item for item in items if item.key not in self._checkpoint.done]
+        logger.info(
+            "%d of %d items have been already ingested, %d left",
+            len(items) - len(pending),
+            len(items),
+            len(pending),
+        )
+
+        queues = [asyncio.Queue(self._queue_size) for _ in self.STAGES]
+        funcs = [self._load, self._split, self._store]
+        workers = []
+        for i, (stage, func) in enumerate(zip(self.STAGES, funcs)):
+            output_queue = queues[i + 1] if i + 1 < len(queues) else None
+            workers.extend(
+                asyncio.create_task(self._worker(stage, func, queues[i], output_queue))
+                for _ in range(self._concurrency[stage])
+            )
+
+        start_time = time.perf_counter()
+        try:
+            for batch in self._batches(pending):
+                await queues[0].put((batch, None))
+            for queue in queues:
+                await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        total_time = time.perf_counter() - start_time
+
+        report = {stage: stats.as_dict() for stage, stats in self.stats.items()}
+        report["total"] = {
+            "items": len(pending),
+            "seconds": round(total_time, 2),
+            "docs_per_second": round(
+                self.stats["store"].num_docs / total_time if total_time > 0 else 0.0,
+                2,
+            ),
+        }
+        report["failed_urls"] = self.failed_urls
+        return report
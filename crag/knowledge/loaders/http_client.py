@@ -0,0 +1,63 @@
+import asyncio
+from typing import List
+
+import aiohttp
+
+_session: aiohttp.ClientSession | None = None
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def get_session(pool_size: int = 32) -> aiohttp.ClientSession:
+    """Return the HTTP client session shared by all async loaders"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=pool_size)
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+async def aclose_session() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def afetch(
+    url: str,
+    timeout: float = 30.0,
+    retries: int = 3,
+    backoff: float = 1.0,
+) -> str:
+    """Fetch text of a page retrying on connection errors, timeouts and
+    temporary server errors with exponential backoff"""
+    session = get_session()
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(url, timeout=client_timeout) as resp:
+                resp.raise_for_status()
+                return await resp.text()
+        except aiohttp.ClientResponseError as e:
+            if e.status not in RETRY_STATUSES or attempt == retries:
+                raise
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == retries:
+                raise
+        await asyncio.sleep(backoff * 2**attempt)
+
+
+async def afetch_all(
+    urls: List[str],
+    max_concurrency: int = 8,
+    timeout: float = 30.0,
+    retries: int = 3,
+) -> List[str]:
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch(url: str) -> str:
+        async with semaphore:
+            return await afetch(url, timeout, retries)
+
+    return await asyncio.gather(*[fetch(url) for url in urls])
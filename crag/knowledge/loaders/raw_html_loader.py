@@ -1,9 +1,19 @@
+import asyncio
 from typing import List
 
 import requests
 from bs4 import BeautifulSoup
 from langchain_core.documents import Document
 
+from crag.knowledge.loaders.http_client import afetch_all
+
+
+def html_to_document(html: str, url: str) -> Document:
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.find("title")
+
+    return Document(page_content=html, metadata={"title": title.string, "source": url})
+
 
 def load(urls: List[str]) -> List[Document]:
     """Load plain HTML text but add page title and source to metadatas"""
@@ -11,13 +21,24 @@ def load(urls: List[str]) -> List[Document]:
     html_docs = []
     for url in urls:
         resp = requests.get(url)
+        html_docs.append(html_to_document(resp.text, url))
 
-        soup = BeautifulSoup(resp.text, "html.parser")
-        title = soup.find("title")
+    return html_docs
 
-        doc = Document(
-            page_content=resp.text, metadata={"title": title.string, "source": url}
-        )
-        html_docs.append(doc)
 
-    return html_docs
+async def aload(
+    urls: List[str],
+    max_concurrency: int = 8,
+    timeout: float = 30.0,
+    retries: int = 3,
+) -> List[Document]:
+    """Concurrently load plain HTML text but add page title and source
+    to metadatas. HTML is parsed in a separate thread."""
+
+    htmls = await afetch_all(urls, max_concurrency, timeout, retries)
+    return await asyncio.gather(
+        *[
+            asyncio.to_thread(html_to_document, html, url)
+            for html, url in zip(htmls, urls)
+        ]
+    )
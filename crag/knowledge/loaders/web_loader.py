@@ -1,8 +1,12 @@
-from typing import List
+import asyncio
+from typing import Any, Dict, List
 
+from bs4 import BeautifulSoup
 from langchain_community.document_loaders import WebBaseLoader
 from langchain_core.documents import Document
 
+from crag.knowledge.loaders.http_client import afetch_all
+
 
 def load(urls: List[str], **kwargs) -> List[Document]:
     """Load and parse into text given URLs"""
@@ -10,3 +14,43 @@ def load(urls: List[str], **kwargs) -> List[Document]:
     docs_list = [WebBaseLoader(url, **kwargs).load() for url in urls]
     docs = [item for sublist in docs_list for item in sublist]
     return docs
+
+
+def build_metadata(soup: BeautifulSoup, url: str) -> Dict[str, Any]:
+    """The same metadata as WebBaseLoader gives"""
+    metadata = {"source": url}
+    if title := soup.find("title"):
+        metadata["title"] = title.get_text()
+    if description := soup.find("meta", attrs={"name": "description"}):
+        metadata["description"] = description.get("content", "No description found.")
+    if html := soup.find("html"):
+        metadata["language"] = html.get("lang", "No language found.")
+    return metadata
+
+
+def parse_html(
+    html: str, url: str, bs_get_text_kwargs: Dict[str, Any] | None = None
+) -> Document:
+    """Parse a page the same way as WebBaseLoader does"""
+    soup = BeautifulSoup(html, "html.parser")
+    text = soup.get_text(**(bs_get_text_kwargs or {}))
+    return Document(page_content=text, metadata=build_metadata(soup, url))
+
+
+async def aload(
+    urls: List[str],
+    max_concurrency: int = 8,
+    timeout: float = 30.0,
+    retries: int = 3,
+    bs_get_text_kwargs: Dict[str, Any] | None = None,
+) -> List[Document]:
+    """Concurrently load and parse into text given URLs.
+    HTML is parsed in a separate thread."""
+
+    htmls = await afetch_all(urls, max_concurrency, timeout, retries)
+    return await asyncio.gather(
+        *[
+            asyncio.to_thread(parse_html, html, url, bs_get_text_kwargs)
+            for html, url in zip(htmls, urls)
+        ]
+    )
@@ -0,0 +1,12 @@
+from .fake import FakeLatencyLLM
+from .prefix_cache import LlamaPrefixCache, PrefixCachedLlamaCpp
+from .scheduler import LLMQueueFullError, LLMScheduler, ScheduledRunnable
+
+__all__ = [
+    "LLMScheduler",
+    "ScheduledRunnable",
+    "LLMQueueFullError",
+    "FakeLatencyLLM",
+    "LlamaPrefixCache",
+    "PrefixCachedLlamaCpp",
+]
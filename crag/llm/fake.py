@@ -0,0 +1,75 @@
+import hashlib
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+
+class FakeLatencyLLM(LLM):
+    """Deterministic fake LLM with configurable latency for benchmarking.
+    The response is chosen by the first key of `responses` that occurs
+    in a prompt, and among candidates by the hash of the prompt."""
+
+    responses: Dict[str, List[str]] = {}
+    default_responses: List[str] = ["Вибачте, я не знаю відповіді на це питання."]
+    prefill_latency: float = 0.0
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-latency"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {
+            "prefill_latency": self.prefill_latency,
+            "token_latency": self.token_latency,
+        }
+
+    def _pick_response(self, prompt: str) -> str:
+        candidates = self.default_responses
+        for key, key_candidates in self.responses.items():
+            if key in prompt:
+                candidates = key_candidates
+                break
+
+        digest = hashlib.sha256(prompt.encode()).digest()
+        return candidates[int.from_bytes(digest[:4], "little") % len(candidates)]
+
+    @staticmethod
+    def _tokenize(text: str) -> List[str]:
+        return [token for token in re.split(r"(\s+)", text) if len(token) > 0]
+
+    def get_num_tokens(self, text: str) -> int:
+        # the default one loads the GPT-2 tokenizer
+        return len(self._tokenize(text))
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        response = self._pick_response(prompt)
+        num_tokens = len(self._tokenize(response))
+        time.sleep(self.prefill_latency + self.token_latency * num_tokens)
+        return response
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        time.sleep(self.prefill_latency)
+        for token in self._tokenize(self._pick_response(prompt)):
+            time.sleep(self.token_latency)
+            chunk = GenerationChunk(text=token)
+            if run_manager is not None:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
@@ -0,0 +1,210 @@
+import hashlib
+import logging
+import pickle
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from string import Formatter
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_community.llms import LlamaCpp
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.outputs import GenerationChunk
+
+from crag.tracing import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+_HITS = REGISTRY.counter(
+    "crag_llm_prefix_cache_hits_total", "Number of prompts with a reused prefix state"
+)
+_TOKENS_SAVED = REGISTRY.counter(
+    "crag_llm_prefill_tokens_saved_total", "Number of prompt tokens not prefilled"
+)
+_SECONDS_SAVED = REGISTRY.counter(
+    "crag_llm_prefill_seconds_saved_total", "Estimated prefill time saved"
+)
+
+
+def static_prefix(template: str) -> str:
+    """Text of a prompt template before the first variable, cut after the last
+    line break, so the tokenization of it doesn't depend on the rest of a prompt.
+    """
+    prefix = ""
+    for literal, field_name, _, _ in Formatter().parse(template):
+        prefix += literal
+        if field_name is not None:
+            break
+    return prefix[: prefix.rfind("\n") + 1]
+
+
+def _longest_token_prefix(a: Sequence[int], b: Sequence[int]) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+@dataclass
+class PrefixState:
+    tokens: Tuple[int, ...]
+    state: Any
+    # time it took to prefill the prefix
+    prefill_time: float
+
+
+@dataclass
+class PrefixCacheStats:
+    hits: int = 0
+    misses: int = 0
+    tokens_saved: int = 0
+    seconds_saved: float = 0.0
+
+
+class LlamaPrefixCache:
+    """Keeps llama.cpp KV states of static prompt prefixes (in memory and
+    optionally on disk) and restores the longest matching one before a call,
+    so only the variable suffix of a prompt is prefilled."""
+
+    def __init__(self, model: Any, model_path: str, cache_dir: str | None = None):
+        self._model = model
+        self._model_path = model_path
+        self._cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self._model_key = self._get_model_key()
+        self._prefixes: List[PrefixState] = []
+        self.stats = PrefixCacheStats()
+
+    def _tokenize(self, text: str) -> List[int]:
+        return self._model.tokenize(text.encode("utf-8"), special=True)
+
+    def _get_model_key(self) -> str:
+        # states are valid only for the same model file and context size,
+        # which is often replaced keeping the same path
+        model_file = Path(self._model_path).stat()
+        return (
+            f"{Path(self._model_path).resolve()}:{model_file.st_size}:"
+            f"{model_file.st_mtime_ns}:{self._model.n_ctx()}"
+        )
+
+    def _cache_path(self, tokens: Tuple[int, ...]) -> Path:
+        digest = hashlib.sha256(
+            (self._model_key + repr(tokens)).encode("utf-8")
+        ).hexdigest()
+        return self._cache_dir / f"{digest}.pkl"
+
+    def add_prefix(self, text: str) -> None:
+        tokens = tuple(self._tokenize(text))
+        if len(tokens) == 0 or any(p.tokens == tokens for p in self._prefixes):
+            return
+
+        if self._cache_dir is not None and self._cache_path(tokens).exists():
+            with open(self._cache_path(tokens), "rb") as f:
+                self._prefixes.append(pickle.load(f))
+            return
+
+        self._model.reset()
+        start_time = time.perf_counter()
+        self._model.eval(tokens)
+        prefix = PrefixState(
+            tokens, self._model.save_state(), time.perf_counter() - start_time
+        )
+        self._prefixes.append(prefix)
+        logger.info(
+            "Prefilled a prompt prefix of %d tokens in %.2f s",
+            len(tokens),
+            prefix.prefill_time,
+        )
+
+        if self._cache_dir is not None:
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(self._cache_path(tokens), "wb") as f:
+                pickle.dump(prefix, f)
+
+    def restore(self, prompt: str) -> int:
+        """Load the state of the longest cached prefix of the prompt if it is
+        longer than the one already evaluated. Returns number of saved tokens."""
+        tokens = self._tokenize(prompt)
+        evaluated = _longest_token_prefix(self._model._input_ids.tolist(), tokens)
+
+        best, best_length = None, evaluated
+        for prefix in self._prefixes:
+            length = _longest_token_prefix(prefix.tokens, tokens)
+            if length > best_length:
+                best, best_length = prefix, length
+
+        if best is None:
+            self.stats.misses += 1
+            return 0
+
+        self._model.load_state(best.state)
+        tokens_saved = best_length - evaluated
+        seconds_saved = best.prefill_time * tokens_saved / len(best.tokens)
+        self.stats.hits += 1
+        self.stats.tokens_saved += tokens_saved
+        self.stats.seconds_saved += seconds_saved
+        _HITS.inc()
+        _TOKENS_SAVED.inc(tokens_saved)
+        _SECONDS_SAVED.inc(seconds_saved)
+        return tokens_saved
+
+
+class PrefixCachedLlamaCpp(LlamaCpp):
+    """LlamaCpp which reuses KV states of static prefixes of given prompt
+    templates. States are computed on the first call (or by `warm_up`)."""
+
+    prompt_templates: List[str] = []
+    """Templates of prompts used with the model, e.g. grading and rewriting"""
+    prefix_cache_dir: Optional[str] = None
+    """Directory to save prefix states to, so they aren't recomputed on restart"""
+    prefix_cache: Optional[LlamaPrefixCache] = None
+
+    _warm_up_lock = threading.Lock()
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def warm_up(self) -> None:
+        with self._warm_up_lock:
+            if self.prefix_cache is not None:
+                return
+            prefix_cache = LlamaPrefixCache(
+                self.client, self.model_path, self.prefix_cache_dir
+            )
+            for template in self.prompt_templates:
+                prefix_cache.add_prefix(static_prefix(template))
+            self.prefix_cache = prefix_cache
+
+    def _restore_prefix(self, prompt: str) -> None:
+        self.warm_up()
+        self.prefix_cache.restore(prompt)
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        if not self.streaming:
+            # otherwise it is restored in `_stream`
+            self._restore_prefix(prompt)
+        return super()._call(prompt, stop, run_manager, **kwargs)
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        self._restore_prefix(prompt)
+        yield from super()._stream(prompt, stop, run_manager, **kwargs)
+
+    @property
+    def prefix_cache_stats(self) -> Dict[str, float]:
+        if self.prefix_cache is None:
+            return {}
+        return vars(self.prefix_cache.stats)
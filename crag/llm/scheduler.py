@@ -0,0 +1,229 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import ensure_config, get_config_list
+
+
+class LLMQueueFullError(RuntimeError):
+    pass
+
+
+_Job = Tuple[Callable[[], Any], asyncio.Future]
+_STREAM_END = object()
+
+
+class LLMScheduler:
+    """Owns the execution of a (not reentrant) language model: all calls are
+    executed one by one in a dedicated worker thread. Pending calls are kept
+    in a bounded queue and served in round-robin order between chats, so one
+    chat can't starve the others. The chat of a call is taken from the
+    `chat_id` field of the configurable section of the runnable config.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = 32,
+        submit_timeout: float = 10.0,
+        long_wait_threshold: float = 30.0,
+    ) -> None:
+        self._max_queue_size = max_queue_size
+        self._submit_timeout = submit_timeout
+        self.long_wait_threshold = long_wait_threshold
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="llm_worker"
+        )
+        self._queues: OrderedDict[Hashable, Deque[_Job]] = OrderedDict()
+        self._size = 0
+        self._is_busy = False
+        self._condition = asyncio.Condition()
+        self._worker: asyncio.Task | None = None
+
+        # exponential moving average of a job execution time
+        self._avg_job_time = 0.0
+
+    @property
+    def queue_size(self) -> int:
+        return self._size
+
+    def bind(self, runnable: Runnable) -> "ScheduledRunnable":
+        return ScheduledRunnable(runnable, self)
+
+    def queue_position(self, chat_id: Hashable | None = None) -> int:
+        """Estimated number of jobs which will be executed before a new job
+        from the given chat"""
+        own_jobs = len(self._queues.get(chat_id, ()))
+        rounds = own_jobs + 1
+        position = own_jobs + int(self._is_busy)
+        for id, queue in self._queues.items():
+            if id != chat_id:
+                position += min(len(queue), rounds)
+        return position
+
+    def estimate_wait(self, chat_id: Hashable | None = None) -> float:
+        return self.queue_position(chat_id) * self._avg_job_time
+
+    def run_sync(self, fn: Callable[[], Any]) -> Any:
+        """Execute a job in the worker thread bypassing the queue"""
+        return self._executor.submit(fn).result()
+
+    async def asubmit(self, fn: Callable[[], Any], chat_id: Hashable | None = None):
+        self._ensure_worker()
+
+        async with self._condition:
+            try:
+                await asyncio.wait_for(
+                    self._condition.wait_for(
+                        lambda: self._size < self._max_queue_size
+                    ),
+                    self._submit_timeout,
+                )
+            except TimeoutError:
+                raise LLMQueueFullError("LLM queue is full")
+
+            future = asyncio.get_running_loop().create_future()
+            self._queues.setdefault(chat_id, deque()).append((fn, future))
+            self._size += 1
+            self._condition.notify_all()
+
+        return await future
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    def _pop_next(self) -> _Job:
+        chat_id, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        # move the chat to the end of the round
+        del self._queues[chat_id]
+        if len(queue) > 0:
+            self._queues[chat_id] = queue
+        self._size -= 1
+        return job
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self._size > 0)
+                fn, future = self._pop_next()
+                self._condition.notify_all()
+
+            # the caller is not waiting for the result anymore
+            if future.done():
+                continue
+
+            self._is_busy = True
+            start = time.monotonic()
+            try:
+                result = await loop.run_in_executor(self._executor, fn)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._is_busy = False
+                elapsed = time.monotonic() - start
+                self._avg_job_time = 0.8 * self._avg_job_time + 0.2 * elapsed
+
+
+class ScheduledRunnable(Runnable):
+    """Runnable which executes a bound runnable through a LLMScheduler"""
+
+    def __init__(self, bound: Runnable, scheduler: LLMScheduler) -> None:
+        self.bound = bound
+        self.scheduler = scheduler
+
+    @staticmethod
+    def _get_chat_id(config: Optional[RunnableConfig]) -> Hashable | None:
+        return ensure_config(config).get("configurable", {}).get("chat_id")
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs):
+        return self.scheduler.run_sync(
+            lambda: self.bound.invoke(input, config, **kwargs)
+        )
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs
+    ):
+        return await self.scheduler.asubmit(
+            lambda: self.bound.invoke(input, config, **kwargs),
+            self._get_chat_id(config),
+        )
+
+    async def abatch(
+        self,
+        inputs: List[Any],
+        config: Optional[RunnableConfig | List[RunnableConfig]] = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> List[Any]:
+        if len(inputs) == 0:
+            return []
+
+        # the whole batch is a single job, so the model can process it at once
+        configs = get_config_list(config, len(inputs))
+        return await self.scheduler.asubmit(
+            lambda: self.bound.batch(
+                inputs, configs, return_exceptions=return_exceptions, **kwargs
+            ),
+            self._get_chat_id(configs[0]),
+        )
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs
+    ) -> AsyncIterator[Any]:
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+
+        def stream_job() -> None:
+            try:
+                for chunk in self.bound.stream(input, config, **kwargs):
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, _STREAM_END)
+
+        job = asyncio.ensure_future(
+            self.scheduler.asubmit(stream_job, self._get_chat_id(config))
+        )
+        try:
+            chunk = None
+            while chunk is not _STREAM_END and not job.done():
+                next_chunk = asyncio.ensure_future(chunks.get())
+                await asyncio.wait(
+                    {next_chunk, job}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not next_chunk.done():
+                    next_chunk.cancel()
+                    break
+                chunk = next_chunk.result()
+                if chunk is not _STREAM_END:
+                    yield chunk
+
+            # raise an error if the job has failed or hasn't been even started
+            await job
+            # the job has finished, so all remaining chunks are already queued
+            while chunk is not _STREAM_END:
+                chunk = await chunks.get()
+                if chunk is not _STREAM_END:
+                    yield chunk
+        finally:
+            if not job.done():
+                job.cancel()
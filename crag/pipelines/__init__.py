@@ -1,5 +1,11 @@
+from .degradation import DegradationPolicy
 from .rag_with_docs_filtering import RAGWithDocsFiltering
 from .rag_with_question_rewriting import RAGWithQuestionRewriting
 from .simple_rag import SimpleRAG
 
-__all__ = ["SimpleRAG", "RAGWithDocsFiltering", "RAGWithQuestionRewriting"]
+__all__ = [
+    "SimpleRAG",
+    "RAGWithDocsFiltering",
+    "RAGWithQuestionRewriting",
+    "DegradationPolicy",
+]
@@ -6,7 +6,9 @@ from langchain_core.language_models import BaseLanguageModel
 from langchain_core.runnables import Runnable
 from langgraph.graph import StateGraph
 
+from crag.llm import LLMScheduler
 from crag.retrievers.base import PipelineRetrieverBase
+from crag.tracing import PipelineTracer
 
 
 class PipelineBase(ABC):
@@ -21,11 +23,19 @@ class PipelineBase(ABC):
     def llm(self) -> BaseLanguageModel:
         pass
 
+    @property
+    def llm_scheduler(self) -> LLMScheduler | None:
+        return None
+
     @property
     def graph(self) -> Runnable:
         graph = self.construct_graph()
         compiled_graph = graph.compile()
-        return compiled_graph
+        # every request is traced node by node (see crag.tracing)
+        tracer = PipelineTracer(
+            type(self).__name__, token_counter=self.llm.get_num_tokens
+        )
+        return compiled_graph.with_config(callbacks=[tracer])
 
     @abstractmethod
     def construct_graph(self) -> StateGraph:
@@ -38,6 +48,10 @@ class SimpleRagGraphState(TypedDict):
     documents: List[Document]
     do_generate: bool
     failed: bool = False
+    # monotonic time by which the request should be answered
+    deadline: float
+    # optional stages skipped because of high load (see DegradationPolicy)
+    skipped_stages: List[str]
 
 
 async def giveup(state: SimpleRagGraphState) -> SimpleRagGraphState:
@@ -0,0 +1,41 @@
+from dataclasses import dataclass
+from typing import Any, Mapping
+
+STAGES = ("grading", "rewrite", "generation")
+
+
+@dataclass(frozen=True)
+class StageThresholds:
+    # the stage is skipped if less time (in seconds) remains of the request budget
+    min_remaining_time: float = 0.0
+    # or at least that many LLM jobs are waiting in the queue
+    max_queue_size: int | None = None
+
+
+class DegradationPolicy:
+    """Decides which optional stages of a pipeline (LLM grading of documents,
+    question rewriting and answer generation) are skipped, so a request is
+    answered within its latency budget under high load. The remaining time is
+    reduced by the expected wait in the LLM queue."""
+
+    def __init__(
+        self, budget: float, stages: Mapping[str, Mapping[str, Any]]
+    ) -> None:
+        unknown_stages = set(stages) - set(STAGES)
+        if len(unknown_stages) > 0:
+            raise ValueError(f"Unknown stages {unknown_stages}, expected {STAGES}")
+
+        self.budget = budget
+        self.thresholds = {
+            stage: StageThresholds(**thresholds) for stage, thresholds in stages.items()
+        }
+
+    def should_skip(self, stage: str, remaining_time: float, queue_size: int) -> bool:
+        thresholds = self.thresholds.get(stage)
+        if thresholds is None:
+            return False
+
+        return remaining_time < thresholds.min_remaining_time or (
+            thresholds.max_queue_size is not None
+            and queue_size >= thresholds.max_queue_size
+        )
@@ -1,11 +1,18 @@
+from typing import Any
+
+from langchain_core.exceptions import OutputParserException
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import PromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.runnables import RunnableConfig
 from langchain_openai import ChatOpenAI
 from langgraph.graph import END, START, StateGraph
 
+from crag.filters import RelevanceFilterBase
+from crag.llm import LLMScheduler
 from crag.pipelines.base import SimpleRagGraphState, giveup
+from crag.pipelines.degradation import DegradationPolicy
 from crag.pipelines.simple_rag import SimpleRAG
 from crag.retrievers.base import PipelineRetrieverBase
 
@@ -23,37 +30,88 @@ class RAGWithDocsFiltering(SimpleRAG):
         retriever: PipelineRetrieverBase,
         llm: BaseLanguageModel,
         rag_prompt: PromptTemplate,
-        gradining_prompt: PromptTemplate,
+        gradining_prompt: PromptTemplate | None = None,
+        batch_grading: bool = False,
+        grading_max_concurrency: int | None = None,
+        llm_scheduler: LLMScheduler | None = None,
+        relevance_filter: RelevanceFilterBase | None = None,
+        degradation: DegradationPolicy | None = None,
     ) -> None:
-        super().__init__(retriever, llm, rag_prompt)
-
-        if isinstance(llm, ChatOpenAI):
+        super().__init__(
+            retriever,
+            llm,
+            rag_prompt,
+            llm_scheduler=llm_scheduler,
+            degradation=degradation,
+        )
+        self._batch_grading = batch_grading
+        self._grading_max_concurrency = grading_max_concurrency
+        # if specified, documents are graded by it instead of the LLM
+        self._relevance_filter = relevance_filter
+
+        if relevance_filter is not None:
+            self._grade_chain = None
+        elif gradining_prompt is None:
+            raise ValueError("Either gradining_prompt or relevance_filter is required")
+        elif isinstance(llm, ChatOpenAI):
             structured_llm = llm.with_structured_output(
                 DocumentGradingResult, method="json_mode"
             )
-            self._grade_chain = gradining_prompt | structured_llm
+            self._grade_chain = gradining_prompt | self._scheduled(structured_llm)
         else:
-            self._grade_chain = gradining_prompt | llm | JsonOutputParser()
+            self._grade_chain = (
+                gradining_prompt | self._scheduled(llm) | JsonOutputParser()
+            )
 
-    async def grade_documents(self, state: SimpleRagGraphState) -> SimpleRagGraphState:
+    @staticmethod
+    def is_relevant(result: Any) -> bool:
+        # consider ill formed output as a bad score
+        if isinstance(result, OutputParserException):
+            return False
+        elif isinstance(result, Exception):
+            raise result
+
+        if not isinstance(result, DocumentGradingResult):
+            if not isinstance(result, dict) or "score" not in result:
+                return False
+            else:
+                result = DocumentGradingResult(score=result["score"])
+
+        return bool(result.score)
+
+    async def grade_documents(
+        self, state: SimpleRagGraphState, config: RunnableConfig
+    ) -> SimpleRagGraphState:
         question = state["question"]
         documents = state["documents"]
 
-        relevant_docs = []
-        for doc in documents:
-            result = await self._grade_chain.ainvoke(
-                {"document": doc.page_content, "question": question}
+        if self._relevance_filter is not None:
+            state["documents"] = await self._relevance_filter.afilter(
+                question, documents
             )
+            return state
+
+        # return documents ungraded, the encoder filter is cheap, so it isn't skipped
+        if len(documents) > 0 and self._skip_stage("grading", state, config):
+            return state
+
+        inputs = [
+            {"document": doc.page_content, "question": question} for doc in documents
+        ]
+        if self._batch_grading:
+            # all documents are graded with one batched call, LLMs split it
+            # into chunks of max_concurrency size (or run them concurrently)
+            results = await self._grade_chain.abatch(
+                inputs,
+                config={"max_concurrency": self._grading_max_concurrency},
+                return_exceptions=True,
+            )
+        else:
+            results = [await self._grade_chain.ainvoke(input) for input in inputs]
 
-            # consider ill formed output as a bad score
-            if not isinstance(result, DocumentGradingResult):
-                if not isinstance(result, dict) or "score" not in result:
-                    continue
-                else:
-                    result = DocumentGradingResult(score=result["score"])
-
-            if result.score:
-                relevant_docs.append(doc)
+        relevant_docs = [
+            doc for doc, result in zip(documents, results) if self.is_relevant(result)
+        ]
 
         state["documents"] = relevant_docs
         return state
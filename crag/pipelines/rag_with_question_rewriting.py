@@ -1,9 +1,13 @@
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import END, START, StateGraph
 
+from crag.filters import RelevanceFilterBase
+from crag.llm import LLMScheduler
 from crag.pipelines.base import SimpleRagGraphState, giveup
+from crag.pipelines.degradation import DegradationPolicy
 from crag.pipelines.rag_with_docs_filtering import RAGWithDocsFiltering
 from crag.retrievers.base import PipelineRetrieverBase
 
@@ -19,11 +23,42 @@ class RAGWithQuestionRewriting(RAGWithDocsFiltering):
         retriever: PipelineRetrieverBase,
         llm: BaseLanguageModel,
         rag_prompt: PromptTemplate,
-        gradining_prompt: PromptTemplate,
+        gradining_prompt: PromptTemplate | None,
         rewriting_prompt: PromptTemplate,
+        batch_grading: bool = False,
+        grading_max_concurrency: int | None = None,
+        llm_scheduler: LLMScheduler | None = None,
+        relevance_filter: RelevanceFilterBase | None = None,
+        degradation: DegradationPolicy | None = None,
     ) -> None:
-        super().__init__(retriever, llm, rag_prompt, gradining_prompt)
-        self._rewrite_chain = rewriting_prompt | llm | StrOutputParser()
+        super().__init__(
+            retriever,
+            llm,
+            rag_prompt,
+            gradining_prompt,
+            batch_grading,
+            grading_max_concurrency,
+            llm_scheduler,
+            relevance_filter,
+            degradation,
+        )
+        self._rewrite_chain = (
+            rewriting_prompt | self._scheduled(llm) | StrOutputParser()
+        )
+
+    async def grade_documents(
+        self, state: RAGWithQuestionRewritingState, config: RunnableConfig
+    ) -> RAGWithQuestionRewritingState:
+        state = await super().grade_documents(state, config)
+
+        # give up instead of rewriting the question
+        if (
+            len(state["documents"]) == 0
+            and state["remaining_rewrites"] > 0
+            and self._skip_stage("rewrite", state, config)
+        ):
+            state["remaining_rewrites"] = 0
+        return state
 
     async def rewrite(
         self, state: RAGWithQuestionRewritingState
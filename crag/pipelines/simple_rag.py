@@ -1,13 +1,18 @@
+import time
+
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import Runnable, RunnableConfig
 from langgraph.graph import END, START, StateGraph
 
+from crag.llm import LLMScheduler
 from crag.pipelines.base import (
     PipelineBase,
     SimpleRagGraphState,
     documents_to_context_str,
 )
+from crag.pipelines.degradation import DegradationPolicy
 from crag.retrievers.base import PipelineRetrieverBase
 
 
@@ -18,11 +23,15 @@ class SimpleRAG(PipelineBase):
         retriever: PipelineRetrieverBase,
         llm: BaseLanguageModel,
         rag_prompt: PromptTemplate,
+        llm_scheduler: LLMScheduler | None = None,
+        degradation: DegradationPolicy | None = None,
     ) -> None:
         super().__init__()
         self._pipe_retriever = retriever
         self._llm = llm
-        self._rag_chain = rag_prompt | llm | StrOutputParser()
+        self._llm_scheduler = llm_scheduler
+        self._degradation = degradation
+        self._rag_chain = rag_prompt | self._scheduled(llm) | StrOutputParser()
 
     @property
     def pipe_retriever(self) -> PipelineRetrieverBase:
@@ -32,22 +41,73 @@ class SimpleRAG(PipelineBase):
     def llm(self) -> BaseLanguageModel:
         return self._llm
 
-    async def retrieve(self, state: SimpleRagGraphState) -> SimpleRagGraphState:
+    @property
+    def llm_scheduler(self) -> LLMScheduler | None:
+        return self._llm_scheduler
+
+    def _scheduled(self, llm: Runnable) -> Runnable:
+        if self._llm_scheduler is None:
+            return llm
+        return self._llm_scheduler.bind(llm)
+
+    def _skip_stage(
+        self, stage: str, state: SimpleRagGraphState, config: RunnableConfig
+    ) -> bool:
+        """Whether an optional stage should be skipped because of high load.
+        Skipped stages are recorded in the state."""
+        if self._degradation is None:
+            return False
+
+        remaining_time = state["deadline"] - time.monotonic()
+        queue_size = 0
+        if self._llm_scheduler is not None:
+            chat_id = config.get("configurable", {}).get("chat_id")
+            remaining_time -= self._llm_scheduler.estimate_wait(chat_id)
+            queue_size = self._llm_scheduler.queue_size
+
+        if self._degradation.should_skip(stage, remaining_time, queue_size):
+            state["skipped_stages"] = (state.get("skipped_stages") or []) + [stage]
+            return True
+        return False
+
+    async def retrieve(
+        self, state: SimpleRagGraphState, config: RunnableConfig
+    ) -> SimpleRagGraphState:
         question = state["question"]
 
+        if self._degradation is not None and state.get("deadline") is None:
+            # the budget can be set per request
+            budget = config.get("configurable", {}).get(
+                "latency_budget", self._degradation.budget
+            )
+            state["deadline"] = time.monotonic() + budget
+
         documents = await self._pipe_retriever.retriever.ainvoke(question)
 
         state["documents"] = documents
         return state
 
-    async def generate(self, state: SimpleRagGraphState) -> SimpleRagGraphState:
+    async def generate(
+        self, state: SimpleRagGraphState, config: RunnableConfig
+    ) -> SimpleRagGraphState:
         question = state["question"]
         documents = state["documents"]
 
+        # fall back to returning only documents
+        if self._skip_stage("generation", state, config):
+            return state
+
+        # an optional async callback which receives generated chunks
+        on_chunk = config.get("configurable", {}).get("generation_callback")
+
         context = documents_to_context_str(documents)
-        generation = await self._rag_chain.ainvoke(
+        generation = ""
+        async for chunk in self._rag_chain.astream(
             {"context": context, "question": question}
-        )
+        ):
+            generation += chunk
+            if on_chunk is not None:
+                await on_chunk(chunk)
 
         state["generation"] = generation
         return state
@@ -1,5 +1,11 @@
+from .bm25 import BM25Retriever
 from .ensemble import EnsembleRetriever
 from .parent_document_retriever import ParentDocumentRetriever
 from .vector_store import VectorStoreRetriever
 
-__all__ = ["VectorStoreRetriever", "EnsembleRetriever", "ParentDocumentRetriever"]
+__all__ = [
+    "VectorStoreRetriever",
+    "EnsembleRetriever",
+    "ParentDocumentRetriever",
+    "BM25Retriever",
+]
@@ -1,9 +1,14 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Tuple
 
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.indexing import RecordManager
+from langchain_core.indexing.api import IndexingResult
 from langchain_core.retrievers import BaseRetriever
 
+from crag.retrievers.incremental import aincremental_update
+
 
 class PipelineRetrieverBase(ABC):
     """The wrapper around Langchain Retriever which gives ability to
@@ -18,6 +23,11 @@ class PipelineRetrieverBase(ABC):
     def retriever(self) -> BaseRetriever:
         return self._retriever
 
+    @property
+    def embeddings(self) -> Embeddings | None:
+        """Embeddings model used by the underlying store (if any)"""
+        return None
+
     @abstractmethod
     async def aadd_documents(self, docs: List[Document], **kwargs) -> List[str]:
         pass
@@ -25,3 +35,40 @@ class PipelineRetrieverBase(ABC):
     @abstractmethod
     async def adelete_documents(self, ids: List[str], **kwargs) -> bool | None:
         pass
+
+    @property
+    def supports_incremental_update(self) -> bool:
+        """Whether the store can be synchronized with `aupdate_documents`"""
+        return False
+
+    async def aupdate_documents(
+        self, docs: List[Document], cleanup: bool = True, **kwargs
+    ) -> IndexingResult:
+        """Incrementally synchronize the store with the given documents:
+        skip unchanged, add new and (if `cleanup`) delete vanished documents of
+        the same sources. Check `supports_incremental_update` before calling it.
+        """
+        raise ValueError(f"{type(self).__name__} doesn't support incremental updates")
+
+    async def _aincremental_update(
+        self,
+        docs: List[Document],
+        record_manager: RecordManager | None,
+        cleanup: bool = True,
+    ) -> Tuple[List[str], IndexingResult]:
+        if record_manager is None:
+            raise ValueError("Incremental mode requires a record manager")
+
+        return await aincremental_update(
+            docs,
+            record_manager,
+            self.aadd_documents,
+            self.adelete_documents,
+            cleanup=cleanup,
+        )
+
+    @staticmethod
+    async def _adelete_keys(record_manager: RecordManager | None, ids: List[str]):
+        # otherwise deleted documents are skipped as unchanged when re-added
+        if record_manager is not None and len(ids) > 0:
+            await record_manager.adelete_keys(ids)
@@ -0,0 +1,97 @@
+import asyncio
+import uuid
+from typing import Any, Callable, Dict, List
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.indexing import RecordManager
+from langchain_core.indexing.api import IndexingResult
+from langchain_core.retrievers import BaseRetriever
+
+from crag.bm25 import BM25Index
+from crag.retrievers.base import PipelineRetrieverBase
+
+
+class BM25IndexRetriever(BaseRetriever):
+    """Langchain retriever over an in-process BM25 index"""
+
+    index: Any
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return [doc for doc, _ in self.index.search(query, self.k)]
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        # the search takes milliseconds, so it isn't worth a thread
+        return [doc for doc, _ in self.index.search(query, self.k)]
+
+
+class BM25Retriever(PipelineRetrieverBase):
+    """Sparse retriever backed by an in-process BM25 index, a lightweight
+    alternative to Elasticsearch. If `persist_dir` is given, the index is loaded
+    from it and every change is appended to its log."""
+
+    def __init__(
+        self,
+        persist_dir: str | None = None,
+        tokenizer: Callable[[str], List[str]] | None = None,
+        k1: float = 1.5,
+        b: float = 0.75,
+        search_kwargs: Dict[str, Any] | None = None,
+        record_manager: RecordManager | None = None,
+        compact_threshold: int = 1000,
+    ) -> None:
+        super().__init__()
+        self._index = BM25Index(
+            tokenizer=tokenizer,
+            k1=k1,
+            b=b,
+            persist_dir=persist_dir,
+            compact_threshold=compact_threshold,
+        )
+        self._retriever = BM25IndexRetriever(index=self._index, **(search_kwargs or {}))
+        self._record_manager = record_manager
+
+    async def _apersist(self) -> None:
+        await asyncio.to_thread(self._index.persist)
+
+    @property
+    def supports_incremental_update(self) -> bool:
+        return self._record_manager is not None
+
+    async def aadd_documents(
+        self,
+        docs: List[Document],
+        ids: List[str] | None = None,
+        incremental: bool = False,
+        **kwargs,
+    ) -> List[str]:
+        if incremental:
+            ids, _ = await self._aincremental_update(docs, self._record_manager)
+            return ids
+
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in docs]
+        # tokenization of many documents is CPU bound
+        await asyncio.to_thread(self._index.add, docs, ids)
+        await self._apersist()
+        return ids
+
+    async def adelete_documents(self, ids: List[str], **kwargs) -> bool | None:
+        num_deleted = await asyncio.to_thread(self._index.delete, ids)
+        await self._apersist()
+        await self._adelete_keys(self._record_manager, ids)
+        return num_deleted == len(set(ids))
+
+    async def aupdate_documents(
+        self, docs: List[Document], cleanup: bool = True, **kwargs
+    ) -> IndexingResult:
+        _, result = await self._aincremental_update(docs, self._record_manager, cleanup)
+        return result
@@ -1,15 +1,102 @@
-from typing import List
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Awaitable, List, Optional, TypeVar
 
 from langchain.retrievers import EnsembleRetriever as LangchainEnsembleRetriever
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.indexing import RecordManager
+from langchain_core.indexing.api import IndexingResult
+from langchain_core.pydantic_v1 import Field
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import patch_config
 
 from crag.retrievers.base import PipelineRetrieverBase
 
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class ChildRetrieverStats:
+    name: str
+    calls: int = 0
+    timeouts: int = 0
+    total_time: float = 0.0
+    last_time: float = 0.0
+
+    @property
+    def avg_time(self) -> float:
+        return self.total_time / self.calls if self.calls > 0 else 0.0
+
+    async def measure(self, aw: Awaitable[T], timeout: float | None = None) -> T:
+        start = time.monotonic()
+        try:
+            return await asyncio.wait_for(aw, timeout)
+        except TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.last_time = time.monotonic() - start
+            self.total_time += self.last_time
+            self.calls += 1
+            logger.debug("%s took %.3f s", self.name, self.last_time)
+
+
+class DeadlineEnsembleRetriever(LangchainEnsembleRetriever):
+    """Langchain EnsembleRetriever which concurrently queries child retrievers
+    with a deadline. Timed out retrievers are dropped from the rank fusion."""
+
+    child_timeout: Optional[float] = None
+    child_stats: List[ChildRetrieverStats] = Field(default_factory=list)
+
+    async def arank_fusion(
+        self,
+        query: str,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        *,
+        config: Optional[RunnableConfig] = None,
+    ) -> List[Document]:
+        async def retrieve(i: int, retriever: BaseRetriever) -> List[Document]:
+            child_config = patch_config(
+                config, callbacks=run_manager.get_child(tag=f"retriever_{i+1}")
+            )
+            try:
+                return await self.child_stats[i].measure(
+                    retriever.ainvoke(query, child_config), self.child_timeout
+                )
+            except TimeoutError:
+                logger.warning(
+                    "%s timed out, skip it in the rank fusion",
+                    self.child_stats[i].name,
+                )
+                # an empty list doesn't contribute to the reciprocal rank fusion
+                return []
+
+        retriever_docs = await asyncio.gather(
+            *[retrieve(i, retriever) for i, retriever in enumerate(self.retrievers)]
+        )
+
+        retriever_docs = [
+            [
+                Document(page_content=doc) if not isinstance(doc, Document) else doc
+                for doc in docs
+            ]
+            for docs in retriever_docs
+        ]
+        return self.weighted_reciprocal_rank(retriever_docs)
+
 
 class EnsembleRetriever(PipelineRetrieverBase):
     """Wrapper around langchain.retrievers.EnsembleRetriever that implements
-    functionality to add"""
+    functionality to add and delete documents. All operations are concurrently
+    fanned out to the child retrievers."""
 
     def __init__(
         self,
@@ -17,24 +104,75 @@ class EnsembleRetriever(PipelineRetrieverBase):
         weights: List[float] | None = None,
         c: int = 60,
         id_key: str | None = None,
+        child_timeout: float | None = None,
+        record_manager: RecordManager | None = None,
     ) -> None:
         super().__init__()
         base_retrievers = [retriever.retriever for retriever in retrievers]
-        self._retriever = LangchainEnsembleRetriever(
-            retrievers=base_retrievers, c=c, id_key=id_key
+        child_stats = [
+            ChildRetrieverStats(name=f"retriever_{i+1}:{type(retriever).__name__}")
+            for i, retriever in enumerate(retrievers)
+        ]
+        self._retriever = DeadlineEnsembleRetriever(
+            retrievers=base_retrievers,
+            c=c,
+            id_key=id_key,
+            child_timeout=child_timeout,
+            child_stats=child_stats,
         )
         if weights is not None:
             self._retriever.weights = weights
         self._child_retrievers = retrievers
+        self._record_manager = record_manager
+
+    @property
+    def child_stats(self) -> List[ChildRetrieverStats]:
+        return self._retriever.child_stats
+
+    @property
+    def embeddings(self) -> Embeddings | None:
+        for retriever in self._child_retrievers:
+            embeddings = getattr(retriever, "embeddings", None)
+            if embeddings is not None:
+                return embeddings
+        return None
+
+    @property
+    def supports_incremental_update(self) -> bool:
+        return self._record_manager is not None
 
-    async def aadd_documents(self, docs: List[Document], **kwargs) -> List[str]:
-        ids = await self._child_retrievers[0].aadd_documents(docs)
-        for base_retriever in self._child_retrievers[1:]:
-            await base_retriever.aadd_documents(docs, ids=ids)
+    async def aadd_documents(
+        self, docs: List[Document], incremental: bool = False, **kwargs
+    ) -> List[str]:
+        if incremental:
+            ids, _ = await self._aincremental_update(docs, self._record_manager)
+            return ids
+
+        # generate ids in advance, so children don't depend on each other
+        ids = kwargs.pop("ids", None)
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in docs]
+
+        await asyncio.gather(
+            *[
+                stats.measure(retriever.aadd_documents(docs, ids=ids, **kwargs))
+                for retriever, stats in zip(self._child_retrievers, self.child_stats)
+            ]
+        )
         return ids
 
     async def adelete_documents(self, ids: List[str], **kwargs) -> bool | None:
-        result = True
-        for base_retriever in self._child_retrievers:
-            result = result and await base_retriever.adelete_documents(ids)
+        results = await asyncio.gather(
+            *[
+                stats.measure(retriever.adelete_documents(ids))
+                for retriever, stats in zip(self._child_retrievers, self.child_stats)
+            ]
+        )
+        await self._adelete_keys(self._record_manager, ids)
+        return all(results)
+
+    async def aupdate_documents(
+        self, docs: List[Document], cleanup: bool = True, **kwargs
+    ) -> IndexingResult:
+        _, result = await self._aincremental_update(docs, self._record_manager, cleanup)
         return result
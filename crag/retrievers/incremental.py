@@ -0,0 +1,66 @@
+import uuid
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.indexing import RecordManager
+from langchain_core.indexing.api import IndexingResult
+
+NAMESPACE_CONTENT = uuid.UUID("6b1fdc1e-3a3c-4b0e-9a8c-0f0b7f1d6c2a")
+
+
+def content_hash_id(doc: Document, source_key: str = "source") -> str:
+    """Deterministic id of a document based on its source and content"""
+    source = str(doc.metadata.get(source_key, ""))
+    return str(uuid.uuid5(NAMESPACE_CONTENT, f"{source}\0{doc.page_content}"))
+
+
+async def aincremental_update(
+    docs: List[Document],
+    record_manager: RecordManager,
+    aadd: Callable[..., Awaitable[List[str]]],
+    adelete: Callable[[List[str]], Awaitable[bool | None]],
+    source_key: str = "source",
+    cleanup: bool = True,
+) -> Tuple[List[str], IndexingResult]:
+    """Synchronize a store with the given documents: documents are keyed by
+    content hash and grouped by source, so unchanged documents are skipped,
+    new (or changed) ones are added and documents which have vanished from
+    the given sources are deleted. Without `cleanup` documents are only
+    deduplicated: nothing is deleted and the new ones don't join any group,
+    so they aren't deleted by later updates of their sources either.
+    """
+    id_to_doc: Dict[str, Document] = {}
+    for doc in docs:
+        id_to_doc.setdefault(content_hash_id(doc, source_key), doc)
+    ids = list(id_to_doc.keys())
+    group_ids = [
+        str(doc.metadata.get(source_key, "")) for doc in id_to_doc.values()
+    ]
+
+    if cleanup:
+        existing_ids = await record_manager.alist_keys(group_ids=list(set(group_ids)))
+        existing_ids = set(existing_ids)
+        ids_to_delete = list(existing_ids.difference(ids))
+    else:
+        exists = await record_manager.aexists(ids)
+        existing_ids = {id for id, id_exists in zip(ids, exists) if id_exists}
+        ids_to_delete = []
+    ids_to_add = [id for id in ids if id not in existing_ids]
+
+    if len(ids_to_add) > 0:
+        await aadd([id_to_doc[id] for id in ids_to_add], ids=ids_to_add)
+    if len(ids_to_delete) > 0:
+        await adelete(ids_to_delete)
+        await record_manager.adelete_keys(ids_to_delete)
+    if cleanup:
+        await record_manager.aupdate(ids, group_ids=group_ids)
+    elif len(ids_to_add) > 0:
+        await record_manager.aupdate(ids_to_add)
+
+    result = IndexingResult(
+        num_added=len(ids_to_add),
+        num_updated=0,
+        num_skipped=len(ids) - len(ids_to_add),
+        num_deleted=len(ids_to_delete),
+    )
+    return ids, result
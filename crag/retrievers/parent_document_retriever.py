@@ -1,19 +1,25 @@
-from typing import List, Sequence
+from typing import Dict, List, Optional, Sequence
 
 from langchain.retrievers import (
     ParentDocumentRetriever as LangchainParentDocumentRetriever,
 )
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.indexing import RecordManager
+from langchain_core.indexing.api import IndexingResult
 from langchain_core.stores import BaseStore
 from langchain_core.vectorstores import VectorStore
 from langchain_text_splitters import TextSplitter
 
 from crag.retrievers.base import PipelineRetrieverBase
+from crag.storage import PGSQLDocStore
 
 
 class ParentDocumentRetriever(PipelineRetrieverBase, LangchainParentDocumentRetriever):
     """ParentDocumentRetriever entended with ability to cascade delete documents"""
 
+    record_manager: Optional[RecordManager] = None
+
     def __init__(
         self,
         vector_store: VectorStore,
@@ -36,37 +42,67 @@ class ParentDocumentRetriever(PipelineRetrieverBase, LangchainParentDocumentRetr
     def retriever(self):
         return self
 
+    @property
+    def embeddings(self) -> Embeddings | None:
+        return self.vectorstore.embeddings
+
+    @property
+    def supports_incremental_update(self) -> bool:
+        return self.record_manager is not None
+
     async def aadd_documents(
         self,
         docs: List[Document],
         ids: List[str] | None = None,
+        incremental: bool = False,
         **kwargs,
     ) -> List[str]:
+        if incremental:
+            ids, _ = await self._aincremental_update(docs, self.record_manager)
+            return ids
+
         docs, full_docs = self._split_docs_for_adding(docs, ids, True)
         children_ids = await self.vectorstore.aadd_documents(docs, **kwargs)
 
-        for _, full_doc in full_docs:
-            full_doc.metadata["children_ids"] = []
-
-        curr_parent_idx = 0
+        parents_children_ids: Dict[str, List[str]] = {id: [] for id, _ in full_docs}
         for child_id, doc in zip(children_ids, docs):
-            parent_id = doc.metadata[self.id_key]
-            # child docs are sorted by parente docs
-            for id, full_doc in full_docs[curr_parent_idx:]:
-                if id == parent_id:
-                    full_doc.metadata["children_ids"].append(child_id)
-                else:
-                    curr_parent_idx += 1
-                    break
-
-        await self.docstore.amset(full_docs)
+            parents_children_ids[doc.metadata[self.id_key]].append(child_id)
+
+        if isinstance(self.docstore, PGSQLDocStore):
+            # the mapping is stored in a dedicated indexed table
+            await self.docstore.amset_with_children(full_docs, parents_children_ids)
+        else:
+            for id, full_doc in full_docs:
+                full_doc.metadata["children_ids"] = parents_children_ids[id]
+            await self.docstore.amset(full_docs)
         return list(id for id, _ in full_docs)
 
     async def adelete_documents(self, ids: List[str]) -> bool | None:
-        for docs in await self.docstore.amget(ids):
-            children_ids = docs.metadata["children_ids"]
-            await self.vectorstore.adelete(children_ids)
+        result = await self._adelete_documents(ids)
+        await self._adelete_keys(self.record_manager, ids)
+        return result
 
+    async def _adelete_documents(self, ids: List[str]) -> bool | None:
+        if isinstance(self.docstore, PGSQLDocStore):
+            return await self.docstore.amdelete_with_children(
+                ids, self.vectorstore.adelete
+            )
+
+        full_docs = await self.docstore.amget(ids)
+        children_ids = [
+            child_id
+            for full_doc in full_docs
+            if full_doc is not None
+            for child_id in full_doc.metadata.get("children_ids", [])
+        ]
+        if children_ids and await self.vectorstore.adelete(children_ids) is False:
+            return False
         await self.docstore.amdelete(ids)
 
-        return True
+        return all(full_doc is not None for full_doc in full_docs)
+
+    async def aupdate_documents(
+        self, docs: List[Document], cleanup: bool = True, **kwargs
+    ) -> IndexingResult:
+        _, result = await self._aincremental_update(docs, self.record_manager, cleanup)
+        return result
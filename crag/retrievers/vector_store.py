@@ -1,6 +1,9 @@
 from typing import List
 
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.indexing import RecordManager
+from langchain_core.indexing.api import IndexingResult
 from langchain_core.vectorstores import VectorStore
 
 from crag.retrievers.base import PipelineRetrieverBase
@@ -9,13 +12,40 @@ from crag.retrievers.base import PipelineRetrieverBase
 class VectorStoreRetriever(PipelineRetrieverBase):
     """Creates a Retriever from a given VectorStore by calling as_retriever method"""
 
-    def __init__(self, vector_store: VectorStore, **kwargs) -> None:
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        record_manager: RecordManager | None = None,
+        **kwargs,
+    ) -> None:
         super().__init__()
         self._vector_store = vector_store
+        self._record_manager = record_manager
         self._retriever = vector_store.as_retriever(**kwargs)
 
-    async def aadd_documents(self, docs: List[Document], **kwargs) -> List[str]:
+    @property
+    def embeddings(self) -> Embeddings | None:
+        return self._vector_store.embeddings
+
+    @property
+    def supports_incremental_update(self) -> bool:
+        return self._record_manager is not None
+
+    async def aadd_documents(
+        self, docs: List[Document], incremental: bool = False, **kwargs
+    ) -> List[str]:
+        if incremental:
+            ids, _ = await self._aincremental_update(docs, self._record_manager)
+            return ids
         return await self._vector_store.aadd_documents(docs, **kwargs)
 
+    async def aupdate_documents(
+        self, docs: List[Document], cleanup: bool = True, **kwargs
+    ) -> IndexingResult:
+        _, result = await self._aincremental_update(docs, self._record_manager, cleanup)
+        return result
+
     async def adelete_documents(self, ids: List[str], **kwargs) -> bool | None:
-        return await self._vector_store.adelete(ids, **kwargs)
+        result = await self._vector_store.adelete(ids, **kwargs)
+        await self._adelete_keys(self._record_manager, ids)
+        return result
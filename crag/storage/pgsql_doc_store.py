@@ -1,9 +1,34 @@
-from typing import AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+import json
+import re
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from langchain_community.storage import SQLStore
 from langchain_core.documents import Document
-from sqlalchemy import Column, and_, delete, select
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import (
+    Column,
+    Delete,
+    Engine,
+    ForeignKeyConstraint,
+    Index,
+    Select,
+    and_,
+    delete,
+    select,
+)
+from sqlalchemy.dialects.postgresql import JSONB, insert
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
 
@@ -20,15 +45,112 @@ class LangchainDocumentsStores(Base):
     page_content: Mapped[str] = mapped_column(nullable=False)
     cmetadata = Column(JSONB, nullable=True)
 
+    __table_args__ = (
+        # allows to use the index for `LIKE 'prefix%'` with any collation
+        Index(
+            "ix_langchain_docs_stores_namespace_key_pattern",
+            "namespace",
+            "key",
+            postgresql_ops={"key": "text_pattern_ops"},
+        ),
+    )
+
+
+class LangchainDocumentsChildren(Base):
+    """Mapping of a parent document to ids of its children in a vector store"""
+
+    __tablename__ = "langchain_docs_children"
+
+    namespace: Mapped[str] = mapped_column(primary_key=True)
+    parent_key: Mapped[str] = mapped_column(primary_key=True)
+    child_id: Mapped[str] = mapped_column(primary_key=True)
+
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["parent_key", "namespace"],
+            [LangchainDocumentsStores.key, LangchainDocumentsStores.namespace],
+            ondelete="CASCADE",
+        ),
+    )
+
+
+def _create_schema(connection) -> None:
+    Base.metadata.create_all(connection)
+    # create_all skips indexes of already existing tables
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+_insert_stmt = insert(LangchainDocumentsStores)
+_UPSERT_STMT = _insert_stmt.on_conflict_do_update(
+    index_elements=[LangchainDocumentsStores.key, LangchainDocumentsStores.namespace],
+    set_={
+        "page_content": _insert_stmt.excluded.page_content,
+        "cmetadata": _insert_stmt.excluded.cmetadata,
+    },
+)
+
+# COPY can't resolve conflicts, so rows are copied into a temporary table first
+_COPY_TMP_TABLE_SQL = (
+    "CREATE TEMP TABLE tmp_langchain_docs_stores "
+    "(LIKE langchain_docs_stores INCLUDING DEFAULTS) ON COMMIT DROP"
+)
+_COPY_SQL = (
+    "COPY tmp_langchain_docs_stores (key, namespace, page_content, cmetadata) "
+    "FROM STDIN"
+)
+_COPY_UPSERT_SQL = (
+    "INSERT INTO langchain_docs_stores (key, namespace, page_content, cmetadata) "
+    "SELECT key, namespace, page_content, cmetadata FROM tmp_langchain_docs_stores "
+    "ON CONFLICT (key, namespace) DO UPDATE SET "
+    "page_content = EXCLUDED.page_content, cmetadata = EXCLUDED.cmetadata"
+)
+
+
+def _copy_row(row: Dict[str, Any]) -> Tuple[str, str, str, str | None]:
+    cmetadata = row["cmetadata"]
+    return (
+        row["key"],
+        row["namespace"],
+        row["page_content"],
+        json.dumps(cmetadata) if cmetadata is not None else None,
+    )
+
 
 class PGSQLDocStore(SQLStore):
+    def __init__(
+        self,
+        *,
+        namespace: str,
+        db_url: Optional[Union[str, Path]] = None,
+        engine: Optional[Union[Engine, AsyncEngine]] = None,
+        engine_kwargs: Optional[Dict[str, Any]] = None,
+        async_mode: Optional[bool] = None,
+        key_batch_size: int = 1000,
+        write_batch_size: int = 500,
+        copy_threshold: Optional[int] = None,
+    ):
+        super().__init__(
+            namespace=namespace,
+            db_url=db_url,
+            engine=engine,
+            engine_kwargs=engine_kwargs,
+            async_mode=async_mode,
+        )
+        self.key_batch_size = key_batch_size
+        self.write_batch_size = write_batch_size
+        # writes of at least this number of documents go through COPY
+        self.copy_threshold = copy_threshold
+
     def create_schema(self) -> None:
-        Base.metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            _create_schema(connection)
 
     async def acreate_schema(self) -> None:
         assert isinstance(self.engine, AsyncEngine)
-        async with self.engine.begin() as session:
-            await session.run_sync(Base.metadata.create_all)
+        async with self.engine.begin() as connection:
+            await connection.run_sync(_create_schema)
 
     def drop(self) -> None:
         Base.metadata.drop_all(bind=self.engine.connect())
@@ -65,72 +187,170 @@ class PGSQLDocStore(SQLStore):
                 )
         return [result.get(key) for key in keys]
 
+    def _rows(self, key_docs: Sequence[Tuple[str, Document]]) -> List[Dict[str, Any]]:
+        # one statement can't update the same row twice, so the last value wins
+        values: Dict[str, Document] = dict(key_docs)
+        return [
+            {
+                "key": key,
+                "namespace": self.namespace,
+                "page_content": doc.page_content,
+                "cmetadata": doc.metadata,
+            }
+            for key, doc in values.items()
+        ]
+
+    def _batches(self, items: Sequence[Any]) -> Iterator[Sequence[Any]]:
+        for i in range(0, len(items), self.write_batch_size):
+            yield items[i : i + self.write_batch_size]
+
+    def _use_copy(self, num_rows: int) -> bool:
+        return self.copy_threshold is not None and num_rows >= self.copy_threshold
+
+    async def _amset(
+        self, key_docs: Sequence[Tuple[str, Document]], session: AsyncSession
+    ) -> None:
+        rows = self._rows(key_docs)
+        if self._use_copy(len(rows)):
+            connection = await session.connection()
+            raw_connection = await connection.get_raw_connection()
+            async with raw_connection.driver_connection.cursor() as cursor:
+                await cursor.execute(_COPY_TMP_TABLE_SQL)
+                async with cursor.copy(_COPY_SQL) as copy:
+                    for row in rows:
+                        await copy.write_row(_copy_row(row))
+                await cursor.execute(_COPY_UPSERT_SQL)
+        else:
+            for batch in self._batches(rows):
+                await session.execute(_UPSERT_STMT, batch)
+
     async def amset(self, key_docs: Sequence[Tuple[str, Document]]) -> None:
         async with self._make_async_session() as session:
-            await self._amdelete([key for key, _ in key_docs], session)
-            session.add_all(
-                [
-                    LangchainDocumentsStores(
-                        namespace=self.namespace,
-                        key=k,
-                        page_content=doc.page_content,
-                        cmetadata=doc.metadata,
+            await self._amset(key_docs, session)
+            await session.commit()
+
+    async def amset_with_children(
+        self,
+        key_docs: Sequence[Tuple[str, Document]],
+        children_ids: Dict[str, List[str]],
+    ) -> None:
+        """Store parent documents together with ids of their children"""
+        async with self._make_async_session() as session:
+            await self._amset(key_docs, session)
+            parent_keys = list(children_ids.keys())
+            for batch in self._batches(parent_keys):
+                await session.execute(
+                    delete(LangchainDocumentsChildren).filter(
+                        LangchainDocumentsChildren.parent_key.in_(batch),
+                        LangchainDocumentsChildren.namespace == self.namespace,
                     )
-                    for k, doc in key_docs
-                ]
+                )
+            rows = [
+                {"namespace": self.namespace, "parent_key": key, "child_id": child_id}
+                for key, ids in children_ids.items()
+                for child_id in dict.fromkeys(ids)
+            ]
+            for batch in self._batches(rows):
+                await session.execute(insert(LangchainDocumentsChildren), batch)
+            await session.commit()
+
+    async def amdelete_with_children(
+        self,
+        keys: Sequence[str],
+        adelete_children: Callable[[List[str]], Awaitable[bool | None]],
+    ) -> bool:
+        """Delete parent documents and all their children. Children ids are
+        resolved with one query and passed to `adelete_children` at once,
+        parents are deleted only if it succeeds. Returns False if some of keys
+        don't exist or deletion of children failed.
+        """
+        keys = list(dict.fromkeys(keys))
+        async with self._make_async_session() as session:
+            stmt = (
+                select(
+                    LangchainDocumentsStores.key,
+                    LangchainDocumentsChildren.child_id,
+                    # documents stored before the mapping table was introduced
+                    LangchainDocumentsStores.cmetadata["children_ids"],
+                )
+                .outerjoin(LangchainDocumentsChildren)
+                .filter(
+                    LangchainDocumentsStores.key.in_(keys),
+                    LangchainDocumentsStores.namespace == self.namespace,
+                )
+                .with_for_update(of=LangchainDocumentsStores)
             )
+            found_keys = set()
+            children_ids: Dict[str, None] = {}
+            for key, child_id, legacy_children_ids in await session.execute(stmt):
+                found_keys.add(key)
+                if child_id is not None:
+                    children_ids[child_id] = None
+                for legacy_child_id in legacy_children_ids or []:
+                    children_ids[legacy_child_id] = None
+
+            if children_ids:
+                if await adelete_children(list(children_ids)) is False:
+                    await session.rollback()
+                    return False
+
+            # mapping rows are removed by ON DELETE CASCADE
+            await self._amdelete(list(found_keys), session)
             await session.commit()
 
+        return len(found_keys) == len(keys)
+
     def mset(self, key_docs: Sequence[Tuple[str, Document]]) -> None:
-        values: Dict[str, Document] = dict(key_docs)
+        rows = self._rows(key_docs)
         with self._make_sync_session() as session:
-            self._mdelete(list(values.keys()), session)
-            session.add_all(
-                [
-                    LangchainDocumentsStores(
-                        namespace=self.namespace,
-                        key=k,
-                        page_content=doc.page_content,
-                        cmetadata=doc.metadata,
-                    )
-                    for k, doc in key_docs
-                ]
-            )
+            if self._use_copy(len(rows)):
+                raw_connection = session.connection().connection
+                with raw_connection.driver_connection.cursor() as cursor:
+                    cursor.execute(_COPY_TMP_TABLE_SQL)
+                    with cursor.copy(_COPY_SQL) as copy:
+                        for row in rows:
+                            copy.write_row(_copy_row(row))
+                    cursor.execute(_COPY_UPSERT_SQL)
+            else:
+                for batch in self._batches(rows):
+                    session.execute(_UPSERT_STMT, batch)
             session.commit()
 
-    def _mdelete(self, keys: Sequence[str], session: Session) -> None:
-        stmt = delete(LangchainDocumentsStores).filter(
+    def _delete_stmt(self, keys: Sequence[str]) -> Delete:
+        return delete(LangchainDocumentsStores).filter(
             and_(
                 LangchainDocumentsStores.key.in_(keys),
                 LangchainDocumentsStores.namespace == self.namespace,
             )
         )
-        session.execute(stmt)
+
+    def _mdelete(self, keys: Sequence[str], session: Session) -> None:
+        for batch in self._batches(keys):
+            session.execute(self._delete_stmt(batch))
 
     async def _amdelete(self, keys: Sequence[str], session: AsyncSession) -> None:
-        stmt = delete(LangchainDocumentsStores).filter(
-            and_(
-                LangchainDocumentsStores.key.in_(keys),
-                LangchainDocumentsStores.namespace == self.namespace,
-            )
+        for batch in self._batches(keys):
+            await session.execute(self._delete_stmt(batch))
+
+    def _keys_stmt(self, prefix: Optional[str]) -> Select:
+        stmt = select(LangchainDocumentsStores.key).filter(
+            LangchainDocumentsStores.namespace == self.namespace
         )
-        await session.execute(stmt)
+        if prefix:
+            # a single literal pattern, so the planner can use the pattern index
+            escaped = re.sub(r"([/%_])", r"/\1", prefix)
+            stmt = stmt.filter(
+                LangchainDocumentsStores.key.like(escaped + "%", escape="/")
+            )
+        # fetch keys from a server-side cursor in batches
+        return stmt.execution_options(yield_per=self.key_batch_size)
 
     def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
         with self._make_sync_session() as session:
-            for v in session.query(LangchainDocumentsStores).filter(  # type: ignore
-                LangchainDocumentsStores.namespace == self.namespace
-            ):
-                if str(v.key).startswith(prefix or ""):
-                    yield str(v.key)
-            session.close()
+            for key in session.scalars(self._keys_stmt(prefix)):
+                yield str(key)
 
     async def ayield_keys(self, *, prefix: Optional[str] = None) -> AsyncIterator[str]:
         async with self._make_async_session() as session:
-            stmt = select(LangchainDocumentsStores).filter(
-                LangchainDocumentsStores.namespace == self.namespace
-            )
-            for v in await session.scalars(stmt):
-                if str(v.key).startswith(prefix or ""):
-                    yield str(v.key)
-            await session.close()
+            async for key in await session.stream_scalars(self._keys_stmt(prefix)):
+                yield str(key)
@@ -0,0 +1,156 @@
+"""Helpers for immutable on-disk index segments. A directory contains segment
+subdirectories and a CURRENT file with the name of the active one, which is
+switched atomically after a new segment is completely written. Changes made
+after a segment was written are appended to its change log."""
+
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+from langchain_core.documents import Document
+
+_CURRENT_FILE = "CURRENT"
+CHANGE_LOG_FILE = "changes.jsonl"
+
+
+def current_segment_dir(persist_dir: Path) -> Path | None:
+    current_file = persist_dir / _CURRENT_FILE
+    if not current_file.exists():
+        return None
+    return persist_dir / current_file.read_text()
+
+
+def new_segment_dir(persist_dir: Path) -> Path:
+    segment_dir = persist_dir / f"segment-{uuid.uuid4().hex}"
+    segment_dir.mkdir(parents=True)
+    return segment_dir
+
+
+def switch_segment(persist_dir: Path, segment_dir: Path) -> None:
+    """Make the segment current and remove all the other ones"""
+    tmp_current = persist_dir / f"{_CURRENT_FILE}.tmp"
+    tmp_current.write_text(segment_dir.name)
+    os.replace(tmp_current, persist_dir / _CURRENT_FILE)
+    for path in persist_dir.glob("segment-*"):
+        if path != segment_dir:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def load_array(path: Path) -> np.ndarray:
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # empty arrays can't be memory mapped
+        return np.load(path)
+
+
+def encode_document(doc: Document) -> bytes:
+    return json.dumps(
+        {"page_content": doc.page_content, "metadata": doc.metadata},
+        ensure_ascii=False,
+    ).encode()
+
+
+class DocumentsBlob:
+    """Memory mapped concatenation of JSON encoded documents"""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray) -> None:
+        self._data = data
+        self._offsets = offsets
+
+    @classmethod
+    def empty(cls) -> "DocumentsBlob":
+        return cls(np.zeros(0, dtype=np.uint8), np.zeros(1, dtype=np.int64))
+
+    @classmethod
+    def load(cls, segment_dir: Path) -> "DocumentsBlob":
+        path = segment_dir / "docs.bin"
+        if path.stat().st_size == 0:
+            data = np.zeros(0, dtype=np.uint8)
+        else:
+            data = np.memmap(path, dtype=np.uint8, mode="r")
+        return cls(data, load_array(segment_dir / "docs_offsets.npy"))
+
+    @staticmethod
+    def write(segment_dir: Path, encoded_docs: Iterable[bytes]) -> None:
+        offsets = [0]
+        with open(segment_dir / "docs.bin", "wb") as f:
+            for data in encoded_docs:
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        np.save(segment_dir / "docs_offsets.npy", np.array(offsets, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def raw(self, idx: int) -> bytes:
+        return self._data[self._offsets[idx] : self._offsets[idx + 1]].tobytes()
+
+    def get(self, idx: int) -> Document:
+        return Document(**json.loads(self.raw(idx)))
+
+
+def write_json(path: Path, value: List[Any] | Dict[str, Any]) -> None:
+    with open(path, "w") as f:
+        json.dump(value, f, ensure_ascii=False)
+
+
+def read_json(path: Path) -> Any:
+    with open(path) as f:
+        return json.load(f)
+
+
+class ChangeLog:
+    """Append-only JSON lines log of changes of a segment. Every change is
+    a dict with an `ids` list of changed documents. A torn last line (e.g. after
+    a crash during a write) is dropped on read."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # number of changed documents
+        self.num_changes = 0
+        self._file = None
+
+    def read(self) -> List[Dict[str, Any]]:
+        changes = []
+        if not self.path.exists():
+            return changes
+
+        valid_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    changes.append(json.loads(line))
+                except ValueError:
+                    break
+                valid_size += len(line)
+        if valid_size < self.path.stat().st_size:
+            os.truncate(self.path, valid_size)
+
+        self.num_changes = sum(len(change["ids"]) for change in changes)
+        return changes
+
+    def append(self, changes: List[Dict[str, Any]]) -> None:
+        if len(changes) == 0:
+            return
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        self._file.write(
+            b"".join(
+                json.dumps(change, ensure_ascii=False).encode() + b"\n"
+                for change in changes
+            )
+        )
+        self._file.flush()
+        self.num_changes += sum(len(change["ids"]) for change in changes)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
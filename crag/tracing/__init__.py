@@ -0,0 +1,13 @@
+from .metrics import REGISTRY, Counter, Gauge, Histogram, MetricsRegistry
+from .server import start_metrics_server
+from .tracer import PipelineTracer
+
+__all__ = [
+    "REGISTRY",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsRegistry",
+    "PipelineTracer",
+    "start_metrics_server",
+]
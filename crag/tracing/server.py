@@ -0,0 +1,26 @@
+from aiohttp import web
+
+from crag.tracing.metrics import REGISTRY, MetricsRegistry
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+async def start_metrics_server(
+    host: str = "127.0.0.1", port: int = 9464, registry: MetricsRegistry = REGISTRY
+) -> web.AppRunner:
+    """Serve the metrics in Prometheus text format on `/metrics`.
+    Returns the runner, call `cleanup` on it to stop the server.
+    """
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
@@ -0,0 +1,265 @@
+import json
+import logging
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage, get_buffer_string
+from langchain_core.outputs import LLMResult
+
+from crag.tracing.metrics import REGISTRY, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class NodeTrace:
+    node: str
+    duration: float = 0.0
+    docs_in: int | None = None
+    docs_out: int | None = None
+    llm_calls: int = 0
+    # unknown if tokens can't be counted
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+
+
+@dataclass
+class RequestTrace:
+    start_time: float
+    nodes: List[NodeTrace] = field(default_factory=list)
+    # run id of a node run -> its trace and start time
+    running_nodes: Dict[UUID, tuple[NodeTrace, float]] = field(default_factory=dict)
+
+
+def _add_tokens(total: int | None, num_tokens: int | None) -> int | None:
+    if num_tokens is None:
+        return total
+    return (total or 0) + num_tokens
+
+
+def _num_docs(state: Any) -> int | None:
+    if isinstance(state, dict) and isinstance(state.get("documents"), list):
+        return len(state["documents"])
+    return None
+
+
+class PipelineTracer(BaseCallbackHandler):
+    """Callback handler which traces every node of a pipeline graph: wall time,
+    LLM calls and tokens, number of documents before and after the node.
+    Metrics are collected into a registry and every finished request is logged
+    as a single structured line.
+    """
+
+    run_inline = True
+
+    def __init__(
+        self,
+        pipeline_name: str,
+        token_counter: Optional[Callable[[str], int]] = None,
+        registry: MetricsRegistry = REGISTRY,
+    ) -> None:
+        self._pipeline_name = pipeline_name
+        self._token_counter = token_counter
+        self._token_counter_failed = False
+        self._lock = threading.Lock()
+        self._requests: Dict[UUID, RequestTrace] = {}
+        # run id of any traced run -> run id of the request (root) run
+        self._roots: Dict[UUID, UUID] = {}
+        # run id of a running LLM call -> trace of the node which made it
+        self._llm_runs: Dict[UUID, NodeTrace] = {}
+
+        self._requests_total = registry.counter(
+            "crag_requests_total", "Number of processed pipeline requests"
+        )
+        self._request_duration = registry.histogram(
+            "crag_request_duration_seconds", "Wall time of pipeline requests"
+        )
+        self._node_duration = registry.histogram(
+            "crag_node_duration_seconds", "Wall time of pipeline graph nodes"
+        )
+        self._node_docs_in = registry.counter(
+            "crag_node_documents_in_total", "Number of documents passed to nodes"
+        )
+        self._node_docs_out = registry.counter(
+            "crag_node_documents_out_total", "Number of documents returned by nodes"
+        )
+        self._llm_calls = registry.counter(
+            "crag_llm_calls_total", "Number of LLM calls (prompts)"
+        )
+        self._prompt_tokens = registry.counter(
+            "crag_llm_prompt_tokens_total", "Number of LLM prompt tokens"
+        )
+        self._completion_tokens = registry.counter(
+            "crag_llm_completion_tokens_total", "Number of LLM completion tokens"
+        )
+        self._rewrites = registry.counter(
+            "crag_rewrite_loops_total", "Number of question rewriting loops"
+        )
+
+    def _count_tokens(self, texts: List[str]) -> int | None:
+        """Total number of tokens in texts or None if they can't be counted"""
+        if self._token_counter is None or self._token_counter_failed:
+            return None
+        try:
+            return sum(self._token_counter(text) for text in texts)
+        except Exception:
+            # e.g. the tokenizer can't be loaded, it won't work on the next call
+            self._token_counter_failed = True
+            logger.exception(
+                "Failed to count tokens, token metrics of %s are disabled",
+                self._pipeline_name,
+            )
+            return None
+
+    def _find_node(self, parent_run_id: UUID | None, metadata) -> NodeTrace | None:
+        root_id = self._roots.get(parent_run_id)
+        if root_id is None:
+            return None
+        node = (metadata or {}).get("langgraph_node")
+        for trace, _ in self._requests[root_id].running_nodes.values():
+            if trace.node == node:
+                return trace
+        return None
+
+    def on_chain_start(
+        self,
+        serialized: Dict[str, Any],
+        inputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        metadata: Dict[str, Any] | None = None,
+        **kwargs: Any,
+    ) -> None:
+        with self._lock:
+            if parent_run_id is None or parent_run_id not in self._roots:
+                # a new request
+                self._roots[run_id] = run_id
+                self._requests[run_id] = RequestTrace(start_time=time.perf_counter())
+                return
+
+            root_id = self._roots[parent_run_id]
+            self._roots[run_id] = root_id
+            node = (metadata or {}).get("langgraph_node")
+            if node is None or kwargs.get("name") != node or node.startswith("__"):
+                return
+
+            trace = NodeTrace(node=node, docs_in=_num_docs(inputs))
+            self._requests[root_id].running_nodes[run_id] = (
+                trace,
+                time.perf_counter(),
+            )
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            root_id = self._roots.pop(run_id, None)
+            if root_id is None:
+                return
+            request = self._requests[root_id]
+
+            if root_id == run_id:
+                del self._requests[root_id]
+                self._finish_request(request, outputs)
+                return
+
+            running = request.running_nodes.pop(run_id, None)
+            if running is not None:
+                trace, start_time = running
+                trace.duration = round(time.perf_counter() - start_time, 4)
+                trace.docs_out = _num_docs(outputs)
+                request.nodes.append(trace)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        with self._lock:
+            root_id = self._roots.pop(run_id, None)
+            if root_id is not None and root_id == run_id:
+                del self._requests[root_id]
+
+    def _on_llm_start(
+        self, texts: List[str], run_id: UUID, parent_run_id: UUID | None, metadata
+    ) -> None:
+        prompt_tokens = self._count_tokens(texts)
+        with self._lock:
+            trace = self._find_node(parent_run_id, metadata)
+            if trace is not None:
+                trace.llm_calls += 1
+                trace.prompt_tokens = _add_tokens(trace.prompt_tokens, prompt_tokens)
+                self._llm_runs[run_id] = trace
+
+    def on_llm_start(
+        self,
+        serialized: Dict[str, Any],
+        prompts: List[str],
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        metadata: Dict[str, Any] | None = None,
+        **kwargs: Any,
+    ) -> None:
+        self._on_llm_start(prompts, run_id, parent_run_id, metadata)
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[BaseMessage]],
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        metadata: Dict[str, Any] | None = None,
+        **kwargs: Any,
+    ) -> None:
+        texts = [get_buffer_string(m) for m in messages]
+        self._on_llm_start(texts, run_id, parent_run_id, metadata)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        token_usage = (response.llm_output or {}).get("token_usage", {})
+        completion_tokens = token_usage.get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = self._count_tokens(
+                [gen.text for gens in response.generations for gen in gens]
+            )
+
+        with self._lock:
+            trace = self._llm_runs.pop(run_id, None)
+            if trace is not None:
+                trace.completion_tokens = _add_tokens(
+                    trace.completion_tokens, completion_tokens
+                )
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            self._llm_runs.pop(run_id, None)
+
+    def _finish_request(self, request: RequestTrace, outputs: Any) -> None:
+        duration = time.perf_counter() - request.start_time
+        pipeline = self._pipeline_name
+        rewrites = sum(1 for trace in request.nodes if trace.node == "rewrite")
+
+        self._requests_total.inc(pipeline=pipeline)
+        self._request_duration.observe(duration, pipeline=pipeline)
+        self._rewrites.inc(rewrites, pipeline=pipeline)
+        for trace in request.nodes:
+            labels = {"pipeline": pipeline, "node": trace.node}
+            self._node_duration.observe(trace.duration, **labels)
+            if trace.docs_in is not None:
+                self._node_docs_in.inc(trace.docs_in, **labels)
+            if trace.docs_out is not None:
+                self._node_docs_out.inc(trace.docs_out, **labels)
+            self._llm_calls.inc(trace.llm_calls, **labels)
+            if trace.prompt_tokens is not None:
+                self._prompt_tokens.inc(trace.prompt_tokens, **labels)
+            if trace.completion_tokens is not None:
+                self._completion_tokens.inc(trace.completion_tokens, **labels)
+
+        log_record = {
+            "pipeline": pipeline,
+            "duration": round(duration, 4),
+            "rewrites": rewrites,
+            "failed": isinstance(outputs, dict) and bool(outputs.get("failed")),
+            "nodes": [asdict(trace) for trace in request.nodes],
+        }
+        logger.info(json.dumps(log_record, ensure_ascii=False))
@@ -0,0 +1,3 @@
+from .local import LocalVectorStore
+
+__all__ = ["LocalVectorStore"]
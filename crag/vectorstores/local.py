@@ -0,0 +1,557 @@
+import asyncio
+import base64
+import logging
+import os
+import threading
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from sqlalchemy import create_engine, text
+
+from crag.storage.segments import (
+    CHANGE_LOG_FILE,
+    ChangeLog,
+    DocumentsBlob,
+    current_segment_dir,
+    encode_document,
+    load_array,
+    new_segment_dir,
+    read_json,
+    switch_segment,
+    write_json,
+)
+
+logger = logging.getLogger(__name__)
+
+_PGVECTOR_SELECT_SQL = text(
+    "SELECT e.id, e.document, e.cmetadata, e.embedding::real[] "
+    "FROM langchain_pg_embedding e "
+    "JOIN langchain_pg_collection c ON e.collection_id = c.uuid "
+    "WHERE c.name = :collection_name"
+)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _encode_vectors(vectors: np.ndarray) -> str:
+    return base64.b64encode(vectors.astype(np.float32).tobytes()).decode()
+
+
+def _decode_vectors(data: str, num_vectors: int) -> np.ndarray:
+    vectors = np.frombuffer(base64.b64decode(data), dtype=np.float32)
+    return vectors.reshape(num_vectors, -1)
+
+
+def _add_change(
+    ids: List[str], docs: List[Document], vectors: np.ndarray
+) -> Dict[str, Any]:
+    return {
+        "op": "add",
+        "ids": ids,
+        "docs": [
+            {"page_content": doc.page_content, "metadata": doc.metadata}
+            for doc in docs
+        ],
+        "vectors": _encode_vectors(vectors),
+    }
+
+
+@dataclass
+class _Segment:
+    vectors: np.ndarray
+    docs_blob: DocumentsBlob
+    ids: List[str]
+    hnsw: Any
+
+
+@dataclass
+class _Snapshot:
+    num_docs: int
+    num_mem_parts: int
+    vector_parts: List[np.ndarray]
+    alive: np.ndarray
+    ids: List[str]
+    mem_docs: Dict[int, Document]
+    docs_blob: DocumentsBlob
+
+
+class LocalVectorStore(VectorStore):
+    """In-process vector store with cosine similarity search.
+
+    Normalized embeddings are kept in a contiguous array memory mapped from
+    `persist_dir` plus an in-memory array of recently added ones, the search is
+    a brute force matrix product. With `index_type="hnsw"` an HNSW graph
+    (hnswlib) is used instead, which is better for large collections.
+    If `persist_dir` is empty, the store can be bootstrapped from an existing
+    pgvector collection without recomputing embeddings.
+
+    Changes are appended to a log of the on-disk segment. Once the log has
+    `compact_threshold` changes, all documents are merged into a new segment in
+    the background of the search, which is blocked only to swap segments.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        persist_dir: str | os.PathLike | None = None,
+        index_type: str = "flat",
+        hnsw_m: int = 16,
+        hnsw_ef_construction: int = 200,
+        hnsw_ef_search: int = 64,
+        bootstrap_connection: str | None = None,
+        bootstrap_collection: str | None = None,
+        autosave: bool = True,
+        compact_threshold: int = 1000,
+    ) -> None:
+        if index_type not in ("flat", "hnsw"):
+            raise ValueError(f"Unknown index type: {index_type}")
+
+        self._embedding = embedding
+        self.persist_dir = Path(persist_dir) if persist_dir is not None else None
+        self.index_type = index_type
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        # log every change to `persist_dir`
+        self.autosave = autosave
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        # only one compaction at a time, it doesn't block searches
+        self._compaction_lock = threading.Lock()
+        self._log: ChangeLog | None = None
+
+        # on-disk segment
+        self._vectors: np.ndarray | None = None
+        self._docs_blob = DocumentsBlob.empty()
+        # in-memory segment
+        self._mem_vectors: List[np.ndarray] = []
+        self._mem_docs: Dict[int, Document] = {}
+        # all documents, indexed by their position
+        self._ids: List[str] = []
+        self._id_to_idx: Dict[str, int] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._hnsw = None
+
+        if self.persist_dir is not None and current_segment_dir(self.persist_dir):
+            self.load()
+        elif bootstrap_connection is not None and bootstrap_collection is not None:
+            self.bootstrap_from_pgvector(bootstrap_connection, bootstrap_collection)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def __len__(self) -> int:
+        return len(self._id_to_idx)
+
+    def _new_hnsw_index(self, dim: int, max_elements: int) -> Any:
+        import hnswlib
+
+        index = hnswlib.Index(space="ip", dim=dim)
+        index.init_index(
+            max_elements=max(max_elements, 16),
+            ef_construction=self.hnsw_ef_construction,
+            M=self.hnsw_m,
+        )
+        index.set_ef(self.hnsw_ef_search)
+        return index
+
+    def _vector_parts(self) -> List[np.ndarray]:
+        parts = [self._vectors] if self._vectors is not None else []
+        parts.extend(self._mem_vectors)
+        return [part for part in parts if len(part) > 0]
+
+    def _all_vectors(self) -> np.ndarray:
+        parts = self._vector_parts()
+        if not parts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(parts)
+
+    def add_embeddings(
+        self,
+        embeddings: List[List[float]] | np.ndarray,
+        documents: List[Document],
+        ids: List[str],
+    ) -> List[str]:
+        """Add documents with precomputed embeddings"""
+        if len(documents) == 0:
+            return []
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            self._add(vectors, documents, ids)
+            if self._log is not None:
+                self._log.append([_add_change(ids, documents, vectors)])
+        return ids
+
+    def _add(
+        self, vectors: np.ndarray, documents: List[Document], ids: List[str]
+    ) -> None:
+        start_idx = len(self._ids)
+        self._alive = np.concatenate([self._alive, np.ones(len(documents), dtype=bool)])
+        end_idx = start_idx + len(documents)
+        if self.index_type == "hnsw":
+            if self._hnsw is None:
+                self._hnsw = self._new_hnsw_index(vectors.shape[1], end_idx)
+            elif self._hnsw.get_max_elements() < end_idx:
+                self._hnsw.resize_index(2 * end_idx)
+            self._hnsw.add_items(vectors, np.arange(start_idx, end_idx))
+
+        for i, (id, doc) in enumerate(zip(ids, documents)):
+            # a new version of a document replaces the old one
+            self._delete([id])
+            self._ids.append(id)
+            self._id_to_idx[id] = start_idx + i
+            self._mem_docs[start_idx + i] = Document(
+                page_content=doc.page_content, metadata=doc.metadata
+            )
+        self._mem_vectors.append(vectors)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        embeddings = self._embedding.embed_documents(texts)
+        ids = self._add_texts_with_embeddings(texts, embeddings, metadatas, ids)
+        self._persist()
+        return ids
+
+    async def aadd_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        embeddings = await self._embedding.aembed_documents(texts)
+        ids = await asyncio.to_thread(
+            self._add_texts_with_embeddings, texts, embeddings, metadatas, ids
+        )
+        await asyncio.to_thread(self._persist)
+        return ids
+
+    def _add_texts_with_embeddings(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]],
+        ids: Optional[List[str]],
+    ) -> List[str]:
+        metadatas = metadatas or [{} for _ in texts]
+        ids = [id or str(uuid.uuid4()) for id in (ids or [None] * len(texts))]
+        docs = [
+            Document(page_content=text, metadata=metadata)
+            for text, metadata in zip(texts, metadatas)
+        ]
+        return self.add_embeddings(embeddings, docs, ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> bool | None:
+        if ids is None:
+            return False
+        with self._lock:
+            num_deleted = self._delete(ids)
+            if num_deleted > 0 and self._log is not None:
+                self._log.append([{"op": "delete", "ids": list(ids)}])
+        self._persist()
+        return num_deleted == len(set(ids))
+
+    async def adelete(
+        self, ids: Optional[List[str]] = None, **kwargs: Any
+    ) -> bool | None:
+        return await asyncio.to_thread(self.delete, ids, **kwargs)
+
+    def _persist(self) -> None:
+        """Write a segment if there isn't one yet or the change log is too long"""
+        if not self.autosave or self.persist_dir is None:
+            return
+        # changes made during a running compaction are carried over by it
+        if not self._compaction_lock.acquire(blocking=False):
+            return
+        try:
+            if self._log is None or self._log.num_changes >= self.compact_threshold:
+                self._compact(self.persist_dir)
+        finally:
+            self._compaction_lock.release()
+
+    def _delete(self, ids: List[str]) -> int:
+        num_deleted = 0
+        for id in ids:
+            idx = self._id_to_idx.pop(id, None)
+            if idx is not None:
+                self._alive[idx] = False
+                self._mem_docs.pop(idx, None)
+                if self._hnsw is not None:
+                    self._hnsw.mark_deleted(idx)
+                num_deleted += 1
+        return num_deleted
+
+    def _apply_changes(self, changes: List[Dict[str, Any]]) -> None:
+        for change in changes:
+            if change["op"] == "add":
+                self._add(
+                    _decode_vectors(change["vectors"], len(change["ids"])),
+                    [Document(**doc) for doc in change["docs"]],
+                    change["ids"],
+                )
+            else:
+                self._delete(change["ids"])
+
+    def _get_document(self, idx: int) -> Document:
+        if idx in self._mem_docs:
+            return self._mem_docs[idx]
+        return self._docs_blob.get(idx)
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4
+    ) -> List[Tuple[Document, float]]:
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        with self._lock:
+            num_docs = len(self._id_to_idx)
+            if num_docs == 0:
+                return []
+            k = min(k, num_docs)
+
+            if self._hnsw is not None:
+                labels, distances = self._hnsw.knn_query(query, k=k)
+                # inner product distance is 1 - cosine similarity
+                results = zip(labels[0], 1 - distances[0])
+            else:
+                parts = self._vector_parts()
+                scores = np.concatenate([part @ query for part in parts])
+                scores[~self._alive] = -np.inf
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top], kind="stable")]
+                results = zip(top, scores[top])
+
+            return [
+                (self._get_document(int(idx)), float(score)) for idx, score in results
+            ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        embedding = self._embedding.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k)
+
+    async def asimilarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        embedding = await self._embedding.aembed_query(query)
+        return await asyncio.to_thread(
+            self.similarity_search_with_score_by_vector, embedding, k
+        )
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        results = self.similarity_search_with_score_by_vector(embedding, k)
+        return [doc for doc, _ in results]
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    async def asimilarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        results = await self.asimilarity_search_with_score(query, k)
+        return [doc for doc, _ in results]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+    def bootstrap_from_pgvector(
+        self, connection: str, collection_name: str, batch_size: int = 1000
+    ) -> int:
+        """Copy all documents and their embeddings from a pgvector collection.
+        Returns the number of copied documents."""
+        engine = create_engine(connection)
+        num_docs = 0
+        try:
+            with engine.connect() as conn:
+                result = conn.execution_options(yield_per=batch_size).execute(
+                    _PGVECTOR_SELECT_SQL, {"collection_name": collection_name}
+                )
+                for rows in result.partitions():
+                    self.add_embeddings(
+                        [row[3] for row in rows],
+                        [
+                            Document(page_content=row[1], metadata=row[2])
+                            for row in rows
+                        ],
+                        [str(row[0]) for row in rows],
+                    )
+                    num_docs += len(rows)
+        finally:
+            engine.dispose()
+
+        logger.info("Bootstrapped %d documents from %s", num_docs, collection_name)
+        if self.persist_dir is not None:
+            self.save()
+        return num_docs
+
+    def save(self, persist_dir: str | os.PathLike | None = None) -> None:
+        """Merge all documents into a new on-disk segment and switch to it"""
+        persist_dir = Path(persist_dir) if persist_dir is not None else self.persist_dir
+        if persist_dir is None:
+            raise ValueError("persist_dir isn't specified")
+
+        with self._compaction_lock:
+            self._compact(persist_dir)
+
+    def _compact(self, persist_dir: Path) -> None:
+        with self._lock:
+            snapshot = _Snapshot(
+                num_docs=len(self._ids),
+                num_mem_parts=len(self._mem_vectors),
+                vector_parts=self._vector_parts(),
+                alive=self._alive.copy(),
+                ids=list(self._ids),
+                mem_docs=dict(self._mem_docs),
+                docs_blob=self._docs_blob,
+            )
+        # the segment is written without the lock, so searches go on
+        segment_dir = new_segment_dir(persist_dir)
+        segment = self._write_segment(segment_dir, snapshot)
+
+        with self._lock:
+            changes = self._changes_since(snapshot)
+            log = ChangeLog(segment_dir / CHANGE_LOG_FILE)
+            log.append(changes)
+            switch_segment(persist_dir, segment_dir)
+            self.persist_dir = persist_dir
+            self._set_segment(segment)
+            self._apply_changes(changes)
+            self._set_log(log)
+
+    def _write_segment(self, segment_dir: Path, snapshot: _Snapshot) -> _Segment:
+        alive_idxs = np.flatnonzero(snapshot.alive)
+        if snapshot.vector_parts:
+            vectors = np.concatenate(snapshot.vector_parts)[alive_idxs]
+        else:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        ids = [snapshot.ids[i] for i in alive_idxs]
+
+        np.save(segment_dir / "vectors.npy", vectors)
+        DocumentsBlob.write(
+            segment_dir,
+            (
+                (
+                    encode_document(snapshot.mem_docs[idx])
+                    if idx in snapshot.mem_docs
+                    else snapshot.docs_blob.raw(idx)
+                )
+                for idx in alive_idxs
+            ),
+        )
+        write_json(segment_dir / "ids.json", ids)
+        hnsw = None
+        if self.index_type == "hnsw" and len(ids) > 0:
+            # labels are positions of documents, which change on compaction
+            hnsw = self._new_hnsw_index(vectors.shape[1], len(ids))
+            hnsw.add_items(vectors, np.arange(len(ids)))
+            hnsw.save_index(str(segment_dir / "hnsw.bin"))
+        return self._read_segment(segment_dir, hnsw)
+
+    def _changes_since(self, snapshot: _Snapshot) -> List[Dict[str, Any]]:
+        """Changes made after the snapshot: deletions of its documents and
+        documents added after it, which are still alive"""
+        changes = []
+        num_docs = snapshot.num_docs
+        deleted_idxs = np.flatnonzero(snapshot.alive & ~self._alive[:num_docs])
+        if len(deleted_idxs) > 0:
+            changes.append(
+                {"op": "delete", "ids": [self._ids[idx] for idx in deleted_idxs]}
+            )
+
+        added_idxs = num_docs + np.flatnonzero(self._alive[num_docs:])
+        if len(added_idxs) > 0:
+            vectors = np.concatenate(self._mem_vectors[snapshot.num_mem_parts :])
+            changes.append(
+                _add_change(
+                    [self._ids[idx] for idx in added_idxs],
+                    [self._mem_docs[idx] for idx in added_idxs],
+                    vectors[added_idxs - num_docs],
+                )
+            )
+        return changes
+
+    def _read_segment(self, segment_dir: Path, hnsw: Any = None) -> _Segment:
+        ids = read_json(segment_dir / "ids.json")
+        vectors = load_array(segment_dir / "vectors.npy")
+        hnsw_path = segment_dir / "hnsw.bin"
+        if hnsw is None and self.index_type == "hnsw" and len(ids) > 0:
+            dim = vectors.shape[1]
+            if hnsw_path.exists():
+                import hnswlib
+
+                hnsw = hnswlib.Index(space="ip", dim=dim)
+                hnsw.load_index(str(hnsw_path), max_elements=len(ids))
+                hnsw.set_ef(self.hnsw_ef_search)
+            else:
+                # the segment was written with the flat index
+                hnsw = self._new_hnsw_index(dim, len(ids))
+                hnsw.add_items(np.asarray(vectors), np.arange(len(ids)))
+        return _Segment(
+            vectors=vectors,
+            docs_blob=DocumentsBlob.load(segment_dir),
+            ids=ids,
+            hnsw=hnsw,
+        )
+
+    def _set_segment(self, segment: _Segment) -> None:
+        self._vectors = segment.vectors
+        self._docs_blob = segment.docs_blob
+        self._mem_vectors = []
+        self._mem_docs = {}
+        self._ids = segment.ids
+        self._id_to_idx = {id: idx for idx, id in enumerate(segment.ids)}
+        self._alive = np.ones(len(segment.ids), dtype=bool)
+        self._hnsw = segment.hnsw
+
+    def _set_log(self, log: ChangeLog) -> None:
+        if self._log is not None:
+            self._log.close()
+        self._log = None
+        if self.autosave:
+            self._log = log
+        else:
+            log.close()
+
+    def load(self) -> None:
+        segment_dir = current_segment_dir(self.persist_dir)
+        segment = self._read_segment(segment_dir)
+        log = ChangeLog(segment_dir / CHANGE_LOG_FILE)
+        changes = log.read()
+
+        with self._lock:
+            self._set_segment(segment)
+            self._apply_changes(changes)
+            self._set_log(log)
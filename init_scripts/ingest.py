@@ -0,0 +1,48 @@
+import asyncio
+import json
+import logging
+
+import hydra
+from hydra.utils import call, instantiate
+from omegaconf import DictConfig
+
+from crag.knowledge.ingestion import (
+    IngestionCheckpoint,
+    IngestionPipeline,
+    aread_sources,
+)
+from crag.knowledge.loaders.http_client import aclose_session
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+
+
+async def aingest(config: DictConfig) -> None:
+    pipe_retriever = instantiate(config["retriever"])
+    ingestion = IngestionPipeline(
+        url_loader=call(config["knowledge"]["loader"]),
+        doc_transformator=call(config["knowledge"]["transform"]),
+        pipe_retriever=pipe_retriever,
+        checkpoint=IngestionCheckpoint(config["checkpoint_path"]),
+        batch_size=config["batch_size"],
+        concurrency=dict(config["concurrency"]),
+        queue_size=config["queue_size"],
+    )
+
+    try:
+        items = await aread_sources(config["sources"])
+        report = await ingestion.arun(items)
+    finally:
+        await aclose_session()
+
+    print(json.dumps(report, indent=2))
+
+
+@hydra.main(version_base="1.3", config_path="../configs", config_name="ingest")
+def main(config: DictConfig) -> None:
+    asyncio.run(aingest(config))
+
+
+if __name__ == "__main__":
+    main()
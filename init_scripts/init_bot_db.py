@@ -38,6 +38,11 @@ def init_pgsql_docstore(store_config: DictConfig):
     docstore.create_schema()
 
 
+def init_sql_record_manager(manager_config: DictConfig):
+    record_manager = instantiate(manager_config, async_mode=False)
+    record_manager.create_schema()
+
+
 # flake8: noqa: C901
 def finditems(obj, key):
     found = []
@@ -71,6 +76,11 @@ def main(config: DictConfig) -> None:
         if cfg["_target_"] == "crag.storage.PGSQLDocStore":
             init_pgsql_docstore(cfg)
 
+    record_manager_cfgs = finditems(config, "record_manager")
+    for cfg in record_manager_cfgs:
+        if cfg["_target_"] == "langchain.indexes.SQLRecordManager":
+            init_sql_record_manager(cfg)
+
 
 if __name__ == "__main__":
     main()
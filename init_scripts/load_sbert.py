@@ -1,6 +1,30 @@
+import argparse
+
 from huggingface_hub import snapshot_download
 
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--onnx",
+    action="store_true",
+    help="also export the embedding model to int8 quantized ONNX (OnnxEmbeddings)",
+)
+args = parser.parse_args()
+
 snapshot_download(
     repo_id="lang-uk/ukr-paraphrase-multilingual-mpnet-base",
     local_dir=".models/ukr-paraphrase-multilingual-mpnet-base",
 )
+if args.onnx:
+    # needs onnx and onnxruntime, which the default embeddings don't use
+    from crag.embeddings.onnx_embeddings import export_onnx
+
+    export_onnx(
+        ".models/ukr-paraphrase-multilingual-mpnet-base",
+        ".models/ukr-paraphrase-multilingual-mpnet-base-onnx-int8",
+    )
+
+# cross-encoder for the relevance filter (configs/relevance_filter/cross_encoder.yaml)
+snapshot_download(
+    repo_id="cross-encoder/mmarco-mMiniLMv2-L12-H384-v1",
+    local_dir=".models/mmarco-mMiniLMv2-L12-H384-v1",
+)